@@ -1,124 +1,43 @@
-import json
-import shutil
-
-import cv2
-import numpy as np
-import os
-import glob
 import time
 import argparse
 
-# Function to fill a region of the image with white color
-def fill_region_with_white(image, startX, startY, endX, endY):
-    startX = max(0, startX)
-    startY = max(0, startY)
-    endX = min(image.shape[1], endX)
-    endY = min(image.shape[0], endY)
-
-    if startX < endX and startY < endY:
-        image[startY:endY, startX:endX] = (255, 255, 255) # pure white
-    return image
-
-def draw_bounding_boxes(image, boxes):
-    for (x, y, w, h) in boxes:
-        cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
-    return image
-
-def read_image(image_path, method):
-    if not method in ['2d', '3d']:
-        raise ValueError("Invalid method. Choose either '2d' or '3d'.")
-    if method == '2d':
-        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    else:
-        image = cv2.imread(image_path)
+import stage_timing
+from anonymize_images_JSON import WhiteOperator, add_output_arguments, anonymize_images, print_statistics, writer_options
 
-    if image is None:
-        raise Exception(f"Error reading {image_path}")
-
-    if method == '2d':
-        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-
-    return image
 
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser(description='Add Laplacian noise to images based on detection boxes')
     argparser.add_argument('image_directory', type=str,  help='Path to the directory containing images')
-    argparser.add_argument('json_file', type=str, help='Path to the JSON file containing detection results')
+    argparser.add_argument('json_file', type=str, help='Path to the JSON, JSON Lines (.jsonl) or NumPy (.npd) detection results')
     argparser.add_argument('output_directory', type=str, help='Path to the directory to save the output images')
     argparser.add_argument("method", type=str, help="Method to use for detection (2d or 3d)")
+    argparser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    add_output_arguments(argparser)
+    stage_timing.add_timing_arguments(argparser)
 
     args = argparser.parse_args()
 
-    METHOD = args.method
-
-    image_directory = args.image_directory
-    json_file = args.json_file
-    output_directory = args.output_directory
-    os.makedirs(output_directory, exist_ok=True)
-
-    print(f"\nAdding white boxes to images in {image_directory}.")
-    print(f"Detections from: {json_file}")
-    print(f"Save to: {output_directory}")
+    print(f"\nAdding white boxes to images in {args.image_directory}.")
+    print(f"Detections from: {args.json_file}")
+    print(f"Save to: {args.output_directory}")
 
-    # Load the JSON file
-    with open(json_file, 'r') as f:
-        detection_data = json.load(f)
+    variants = [(args.output_directory, [WhiteOperator()])]
 
-    # Initialize counters and lists for statistics
-    images_processed = 0
-    total_images = len([f for f in os.listdir(image_directory)])  # Count number of images to be processed
-    blurred_images = 0
-    errors = []
+    stage_timing.setup(args)
 
     # Start timer
     start_time = time.time()
 
-    # Process each detection file in the directory
-    for timestamp, detections in detection_data.items():
-        images_processed += 1
-        print(f"\rProgress: {(100 * images_processed / total_images):.2f}%", end=" ")
-        error_msg = None
-        try:
-            image_path = os.path.join(image_directory, f"{timestamp}.png")
-            image = read_image(image_path, METHOD)
-
-            if len(detections[0]) > 4:
-                human_bodies = [(int(x), int(y), int(w), int(h)) for x, y, w, h, confidence in detections]
-            else:
-                human_bodies = [(int(x), int(y), int(w), int(h)) for x, y, w, h in detections]
-
-            output_path = os.path.join(output_directory, os.path.basename(image_path))
-
-            boxes = []
-
-            # indices = cv2.dnn.NMSBoxes(boxes, confidences, score_threshold=0.5, nms_threshold=0.4)
-            detected_boxes = []
-            if human_bodies:
-                for (x, y, w, h) in human_bodies:
-                    x, y, w, h = int(x), int(y), int(w), int(h)
-                    detected_boxes.append((x, y, w, h))
-                    image = fill_region_with_white(image, x, y, x + w, y + h)
-                cv2.imwrite(output_path, image)
-            else:
-                shutil.copy(image_path, output_path)
-
-        except Exception as e:
-            print(f"Error processing {timestamp}: {str(e)}")
-            errors.append(error_msg)
+    # Frames without detections are copied unchanged
+    with stage_timing.profiled(args.profile):
+        stats = anonymize_images(args.image_directory, args.json_file, args.method, variants, copy_undetected=True,
+                                 workers=args.workers,
+                                 output_options=writer_options(args),
+                                 gray_to_bgr=args.gray_to_bgr, include_absent=args.passthrough)
 
     # Stop timer
     end_time = time.time()
 
-    # Print detailed statistics
-    print(f"\nTotal images processed: {images_processed}")
-    print(f"Images with detected humans and filled with white: {blurred_images}")
-    print(f"Percentage of images with detected humans: {(blurred_images / images_processed) * 100:.2f}%")
-    print(f"Error processing images: {len(errors)}")
-    print(f"Time taken: {end_time - start_time:.2f} seconds")
-
-    # Optional: Save the list of errors to a file
-    with open(os.path.join(output_directory, 'errors.log'), 'w') as f:
-        for item in errors:
-            f.write("%s\n" % item)
-
+    print_statistics(stats, variants, end_time - start_time)
+    stage_timing.finish(args, stats['images_processed'])
     print("All images have been processed and filled with white based on detection boxes.")
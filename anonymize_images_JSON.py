@@ -0,0 +1,661 @@
+import argparse
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+from detections_io import iter_detections
+from dp_noise import FastNoise, box_union_mask
+from image_files import Progress, count_files, sorted_files
+from image_output import IMAGE_FORMATS, LINK_MODES, ImageWriter
+import stage_timing
+
+
+def read_image(image_path, method, gray_to_bgr=False):
+    # 2d images are anonymized and written single-channel unless gray_to_bgr asks for the former 3-channel copies
+    if not method in ['2d', '3d']:
+        raise ValueError("Invalid method. Choose either '2d' or '3d'.")
+    with stage_timing.stage('imread'):
+        if method == '2d':
+            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        else:
+            image = cv2.imread(image_path)
+
+    if image is None:
+        raise Exception(f"Error reading {image_path}")
+
+    if method == '2d' and gray_to_bgr:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+    return image
+
+
+# Define functions for differential privacy noise addition
+def calculate_sensitivity_rgb_images(image_data):
+    return np.max(image_data)
+
+def add_noise_differential_privacy_rgb_images_laplace(image_data, epsilon, random=np.random):
+    sensitivity = calculate_sensitivity_rgb_images(image_data)
+    scale = sensitivity / epsilon
+    laplace_noise = random.laplace(scale=scale, size=image_data.shape)
+    noisy_image_data = image_data + laplace_noise
+    noisy_image_data = np.clip(noisy_image_data, 0, 255)
+    return noisy_image_data
+
+def add_noise_differential_privacy_rgb_images_gaussian(image_data, epsilon, random=np.random):
+    sensitivity = calculate_sensitivity_rgb_images(image_data)
+    scale = sensitivity / epsilon
+    gaussian_noise = random.normal(scale=scale, size=image_data.shape)
+    noisy_image_data = image_data + gaussian_noise
+    noisy_image_data = np.clip(noisy_image_data, 0, 255)
+    return noisy_image_data
+
+
+# Kernel size of the reference Gaussian blur
+BLUR_KERNEL_SIZE = 99
+
+def gaussian_kernel_sigma(sigma, ksize=BLUR_KERNEL_SIZE):
+    # Standard deviation of the truncated ksize x ksize kernel, which is smaller than sigma once sigma ~ ksize / 4
+    kernel = cv2.getGaussianKernel(ksize, sigma).ravel()
+    offsets = np.arange(ksize) - ksize // 2
+    return float(np.sqrt(np.sum(kernel * offsets ** 2)))
+
+def box_sizes_for_gaussian(sigma, passes=3):
+    # Widths of `passes` successive box blurs whose combined variance matches sigma ** 2
+    ideal_width = np.sqrt(12 * sigma ** 2 / passes + 1)
+    lower = int(np.floor(ideal_width))
+    if lower % 2 == 0:
+        lower -= 1
+    upper = lower + 2
+    lower_passes = round((12 * sigma ** 2 - passes * lower ** 2 - 4 * passes * lower - 3 * passes) / (-4 * lower - 4))
+    return [lower if i < lower_passes else upper for i in range(passes)]
+
+def blur_gaussian(roi, sigma):
+    return cv2.GaussianBlur(roi, (BLUR_KERNEL_SIZE, BLUR_KERNEL_SIZE), sigma)
+
+def blur_downscale(roi, sigma):
+    # Blurs a copy shrunk by `factor` with a kernel shrunk by the same factor, then scales it back up
+    factor = max(1, int(sigma // 4))
+    height, width = roi.shape[:2]
+    small = cv2.resize(roi, (max(1, width // factor), max(1, height // factor)), interpolation=cv2.INTER_AREA)
+    ksize = max(1, BLUR_KERNEL_SIZE // factor) | 1
+    small = cv2.GaussianBlur(small, (ksize, ksize), sigma / factor)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+
+def blur_box(roi, sigma):
+    blurred = roi
+    for size in box_sizes_for_gaussian(gaussian_kernel_sigma(sigma)):
+        blurred = cv2.blur(blurred, (size, size))
+    return blurred
+
+def blur_pixelate(roi, sigma):
+    # Mosaic with sigma x sigma pixel blocks
+    block = max(1, int(round(sigma)))
+    height, width = roi.shape[:2]
+    small = cv2.resize(roi, (max(1, -(-width // block)), max(1, -(-height // block))), interpolation=cv2.INTER_AREA)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+
+BLUR_ENGINES = {'gaussian': blur_gaussian, 'downscale': blur_downscale, 'box': blur_box, 'pixelate': blur_pixelate}
+
+# Function to blur a region of the image
+def blur_region(image, startX, startY, endX, endY, sigma=30, engine='gaussian'):
+    startX = max(0, startX)
+    startY = max(0, startY)
+    endX = min(image.shape[1], endX)
+    endY = min(image.shape[0], endY)
+
+    roi = image[startY:endY, startX:endX]
+
+    if roi.size == 0:
+        return image
+
+    blurred_roi = BLUR_ENGINES[engine](roi, sigma)
+    image[startY:endY, startX:endX] = blurred_roi
+    return image
+
+
+# Function to fill a region of the image with white color
+def fill_region_with_white(image, startX, startY, endX, endY):
+    startX = max(0, startX)
+    startY = max(0, startY)
+    endX = min(image.shape[1], endX)
+    endY = min(image.shape[0], endY)
+
+    if startX < endX and startY < endY:
+        image[startY:endY, startX:endX] = 255 # pure white, in every channel
+    return image
+
+
+def legacy_random(seed):
+    # Seeded operators draw their legacy (float64) noise from their own RandomState, unseeded ones from np.random
+    if seed is None:
+        return np.random
+    return np.random.RandomState(np.random.MT19937(seed))
+
+
+# Region operators: apply(image, boxes) anonymizes the (x, y, w, h) boxes of one frame and returns the image
+class NoiseOperator:
+    PARAMETERS = {'type': str, 'epsilon': float, 'union_mask': bool, 'fast': bool, 'seed': int}
+
+    def __init__(self, type='laplacian', epsilon=0.01, union_mask=False, fast=False, seed=None):
+        if type not in ('laplacian', 'gaussian'):
+            raise ValueError("Invalid noise type. Choose either 'laplacian' or 'gaussian'.")
+        self.noise_type = type
+        self.epsilon = epsilon
+        self.union_mask = union_mask
+        self.seed = seed
+        self.fast_noise = FastNoise(seed) if fast else None
+        self.random = legacy_random(seed)
+        self.covered_pixels = 0
+        self.box_pixels = 0
+
+    def reseed(self, seed):
+        if self.fast_noise is not None:
+            self.fast_noise.rng = np.random.default_rng(seed)
+        self.random = legacy_random(seed)
+
+    def add_noise(self, region):
+        # The fast path noises region in place, the legacy functions return a new float array
+        if self.fast_noise is not None:
+            if self.noise_type == 'laplacian':
+                return self.fast_noise.add_laplace(region, epsilon=self.epsilon)
+            return self.fast_noise.add_gaussian(region, epsilon=self.epsilon)
+        if self.noise_type == 'laplacian':
+            return add_noise_differential_privacy_rgb_images_laplace(region, epsilon=self.epsilon, random=self.random)
+        return add_noise_differential_privacy_rgb_images_gaussian(region, epsilon=self.epsilon, random=self.random)
+
+    def apply(self, image, boxes):
+        if self.union_mask:
+            # One noise pass over every covered pixel, with the sensitivity taken over all of them
+            mask, box_pixels = box_union_mask(image.shape, boxes)
+            covered = image[mask]
+            if covered.size:
+                image[mask] = self.add_noise(covered)
+            self.covered_pixels += int(np.count_nonzero(mask))
+            self.box_pixels += box_pixels
+            return image
+
+        for (x, y, w, h) in boxes:
+            roi = image[max(0, y):min(y + h, image.shape[0]), max(0, x):min(x + w, image.shape[1])]
+            if roi.size == 0:
+                # Boxes entirely outside the frame have no pixels and no sensitivity
+                continue
+            noisy_roi = self.add_noise(roi)
+            if noisy_roi is not roi:
+                image[max(0, y):min(y + h, image.shape[0]), max(0, x):min(x + w, image.shape[1])] = noisy_roi
+        return image
+
+    def describe(self):
+        return f"{self.noise_type} noise, epsilon {self.epsilon}"
+
+    def summary(self):
+        if not self.union_mask:
+            return None
+        return (f"Pixels noised: {self.covered_pixels} (box-by-box passes would noise {self.box_pixels}, "
+                f"{self.box_pixels / max(self.covered_pixels, 1):.2f}x as many)")
+
+class NoiseSweep:
+    """
+    Noise of one type at several epsilon values, computed together for every frame.
+
+    operators() returns one operator per epsilon, to be used as the first operator of consecutive variants. The first
+    of them noises the frame at every epsilon at once: the boxes are cut out once and the noise of all levels is drawn
+    in one call per region. The others only write back their precomputed level.
+
+    With union_mask the sensitivity is taken once, over all covered pixels. Box by box it is taken per box and per
+    level, like NoiseOperator does: where boxes overlap, each level has already been noised differently by the
+    earlier boxes, so the maxima differ between levels.
+    """
+
+    def __init__(self, type='laplacian', epsilons=(0.01,), union_mask=False, fast=False, seed=None):
+        if type not in ('laplacian', 'gaussian'):
+            raise ValueError("Invalid noise type. Choose either 'laplacian' or 'gaussian'.")
+        self.noise_type = type
+        self.epsilons = np.asarray(epsilons, dtype=np.float64)
+        self.union_mask = union_mask
+        self.seed = seed
+        self.fast_noise = FastNoise(seed) if fast else None
+        self.random = legacy_random(seed)
+        self.covered_pixels = 0
+        self.box_pixels = 0
+        self.levels = None
+
+    def reseed(self, seed):
+        if self.fast_noise is not None:
+            self.fast_noise.rng = np.random.default_rng(seed)
+        self.random = legacy_random(seed)
+
+    def operators(self):
+        return [NoiseSweepLevel(self, i) for i in range(len(self.epsilons))]
+
+    def add_noise(self, levels, sensitivities):
+        # levels holds one uint8 copy of the region per epsilon and is noised in place
+        scales = sensitivities / self.epsilons
+        if self.fast_noise is not None:
+            return self.fast_noise.add_levels(levels, scales, self.noise_type)
+        shape = (-1,) + (1,) * (levels.ndim - 1)
+        if self.noise_type == 'laplacian':
+            noise = self.random.laplace(size=levels.shape)
+        else:
+            noise = self.random.normal(size=levels.shape)
+        noise *= scales.reshape(shape)
+        noise += levels
+        levels[...] = np.clip(noise, 0, 255)
+        return levels
+
+    def compute(self, image, boxes):
+        count = len(self.epsilons)
+        if self.union_mask:
+            mask, box_pixels = box_union_mask(image.shape, boxes)
+            covered = image[mask]
+            levels = np.repeat(covered[None], count, axis=0)
+            if covered.size:
+                self.add_noise(levels, np.full(count, np.max(covered), dtype=np.float64))
+            self.covered_pixels += int(np.count_nonzero(mask))
+            self.box_pixels += box_pixels
+            self.levels = (mask, levels)
+            return
+
+        # Boxes are noised one after the other inside the bounding rectangle of all of them, so where boxes overlap
+        # every level sees its own noise from the earlier boxes, like the box-by-box loop of NoiseOperator
+        clipped = [(max(0, x), max(0, y), min(x + w, image.shape[1]), min(y + h, image.shape[0])) for x, y, w, h in boxes]
+        clipped = [box for box in clipped if box[0] < box[2] and box[1] < box[3]]
+        if not clipped:
+            self.levels = None
+            return
+        start_x, start_y = min(box[0] for box in clipped), min(box[1] for box in clipped)
+        end_x, end_y = max(box[2] for box in clipped), max(box[3] for box in clipped)
+        levels = np.repeat(image[None, start_y:end_y, start_x:end_x], count, axis=0)
+        for x0, y0, x1, y1 in clipped:
+            roi = levels[:, y0 - start_y:y1 - start_y, x0 - start_x:x1 - start_x]
+            sensitivities = roi.reshape(count, -1).max(axis=1).astype(np.float64)
+            self.add_noise(roi, sensitivities)
+        self.levels = ((slice(start_y, end_y), slice(start_x, end_x)), levels)
+
+    def apply_level(self, index, image, boxes):
+        if index == 0:
+            self.compute(image, boxes)
+        if self.levels is not None:
+            region, levels = self.levels
+            image[region] = levels[index]
+        return image
+
+def parse_epsilons(value):
+    # "0.01,0.1,1,10" -> [0.01, 0.1, 1.0, 10.0]
+    return [float(epsilon) for epsilon in value.split(',') if epsilon.strip()]
+
+def sweep_variants(output_directory, sweep):
+    # One output subdirectory per epsilon, e.g. <output_directory>/epsilon_0.1
+    return [(os.path.join(output_directory, f"epsilon_{epsilon:g}"), [operator])
+            for epsilon, operator in zip(sweep.epsilons, sweep.operators())]
+
+class NoiseSweepLevel:
+    def __init__(self, sweep, index):
+        self.sweep = sweep
+        self.index = index
+
+    def apply(self, image, boxes):
+        return self.sweep.apply_level(self.index, image, boxes)
+
+    def describe(self):
+        return f"{self.sweep.noise_type} noise, epsilon {self.sweep.epsilons[self.index]:g}"
+
+    def summary(self):
+        if not self.sweep.union_mask or self.index != 0:
+            return None
+        return (f"Pixels noised per epsilon: {self.sweep.covered_pixels} (box-by-box passes would noise "
+                f"{self.sweep.box_pixels}, {self.sweep.box_pixels / max(self.sweep.covered_pixels, 1):.2f}x as many)")
+
+class BlurOperator:
+    PARAMETERS = {'sigma': int, 'engine': str}
+
+    def __init__(self, sigma=30, engine='gaussian'):
+        if engine not in BLUR_ENGINES:
+            raise ValueError(f"Invalid blur engine. Choose one of {', '.join(BLUR_ENGINES)}.")
+        self.sigma = sigma
+        self.engine = engine
+
+    def apply(self, image, boxes):
+        for (x, y, w, h) in boxes:
+            image = blur_region(image, x, y, x + w, y + h, self.sigma, self.engine)
+        return image
+
+    def describe(self):
+        return f"{self.engine} blur, sigma {self.sigma}"
+
+    def summary(self):
+        return None
+
+class WhiteOperator:
+    PARAMETERS = {}
+
+    def apply(self, image, boxes):
+        for (x, y, w, h) in boxes:
+            image = fill_region_with_white(image, x, y, x + w, y + h)
+        return image
+
+    def describe(self):
+        return "white fill"
+
+    def summary(self):
+        return None
+
+OPERATORS = {'noise': NoiseOperator, 'blur': BlurOperator, 'white': WhiteOperator}
+
+
+def parse_operator(spec):
+    # "name" or "name:key=value,key=value", e.g. "blur:sigma=30,engine=box" or "noise:type=gaussian,epsilon=0.1"
+    name, _, parameters = spec.partition(':')
+    if name not in OPERATORS:
+        raise ValueError(f"Unknown operator '{name}'. Choose one of {', '.join(OPERATORS)}.")
+    operator_class = OPERATORS[name]
+    kwargs = {}
+    for parameter in filter(None, parameters.split(',')):
+        key, _, value = parameter.partition('=')
+        if key not in operator_class.PARAMETERS:
+            raise ValueError(f"Unknown parameter '{key}' for operator '{name}'")
+        value_type = operator_class.PARAMETERS[key]
+        kwargs[key] = value.lower() in ('1', 'true', 'yes') if value_type is bool else value_type(value)
+    return operator_class(**kwargs)
+
+
+def parse_chain(chain):
+    # Operators applied one after the other, joined by '+', e.g. "blur:sigma=30+noise:epsilon=0.1"
+    return [parse_operator(spec) for spec in chain.split('+')]
+
+
+def detection_boxes(detections):
+    return [(int(detection[0]), int(detection[1]), int(detection[2]), int(detection[3])) for detection in detections]
+
+
+def noise_sources(variants):
+    # The distinct stateful noise generators of the variants, in a fixed order
+    sources = []
+    for _, operators in variants:
+        for operator in operators:
+            source = getattr(operator, 'sweep', operator)
+            if hasattr(source, 'reseed') and not any(source is known for known in sources):
+                sources.append(source)
+    return sources
+
+
+def reseed_frame(sources, seed, frame_index):
+    # Every frame derives its noise from (seed, frame index), so seeded output does not depend on how the frames are
+    # split between workers, nor on whether there are workers at all
+    if seed is not None:
+        np.random.seed(np.random.SeedSequence([seed, frame_index]).generate_state(1)[0])
+    for source in sources:
+        if source.seed is not None:
+            source.reseed(np.random.SeedSequence([source.seed, frame_index]))
+
+
+def anonymize_frames(frames, image_directory, method, variants, copy_undetected, writer, gray_to_bgr=False,
+                     first_index=0, seed=None):
+    # Anonymizes a list of (timestamp, detections) pairs, the first of them frame number first_index of the detections
+    # file, and returns their statistics; write errors stay in writer
+    stats = {'images_processed': 0, 'anonymized_images': 0, 'copied_images': 0, 'decodes_avoided': 0, 'errors': []}
+    sources = noise_sources(variants)
+    for frame_index, (timestamp, detections) in enumerate(frames, first_index):
+        stats['images_processed'] += 1
+        image_path = os.path.join(image_directory, f"{timestamp}.png")
+        try:
+            human_bodies = detection_boxes(detections)
+            if not human_bodies:
+                # Frames without boxes are linked or copied as files; only a non-PNG output format decodes them
+                if copy_undetected:
+                    for output_directory, _ in variants:
+                        writer.passthrough(image_path, output_directory, timestamp)
+                    stats['copied_images'] += 1
+                if not copy_undetected or writer.image_format == 'png':
+                    stats['decodes_avoided'] += 1
+                continue
+
+            reseed_frame(sources, seed, frame_index)
+            image = read_image(image_path, method, gray_to_bgr)
+            for i, (output_directory, operators) in enumerate(variants):
+                # The last variant may work on the decoded frame itself, the others on copies
+                variant_image = image if i == len(variants) - 1 else image.copy()
+                for operator in operators:
+                    with stage_timing.stage(operator.describe()):
+                        variant_image = operator.apply(variant_image, human_bodies)
+                writer.write(writer.output_path(output_directory, timestamp), variant_image)
+            stats['anonymized_images'] += 1
+
+        except Exception as e:
+            print(f"Error processing {timestamp}: {str(e)}")
+            stats['errors'].append(f"{image_path}: {e}")
+    return stats
+
+
+def merge_stats(stats, chunk_stats):
+    for key in ('images_processed', 'anonymized_images', 'copied_images', 'decodes_avoided'):
+        stats[key] += chunk_stats[key]
+    stats['errors'].extend(chunk_stats['errors'])
+    for key, count in chunk_stats.get('outputs', {}).items():
+        stats['outputs'][key] = stats['outputs'].get(key, 0) + count
+
+
+def detection_frames(detections_file, image_directory=None, stats=None):
+    # Yields the (timestamp, detections) pairs of the detections file and then, given image_directory, an empty
+    # detection list for every image of it that the file does not mention, counted in stats['absent_images']
+    seen = set()
+    for timestamp, detections in iter_detections(detections_file):
+        if image_directory is not None:
+            seen.add(str(timestamp))
+        yield timestamp, detections
+    if image_directory is None:
+        return
+    for image_path in sorted_files(image_directory):
+        timestamp = os.path.basename(image_path)[:-len('.png')]
+        if timestamp not in seen:
+            if stats is not None:
+                stats['absent_images'] += 1
+            yield timestamp, []
+
+
+def chunk_frames(frames, chunk_size):
+    # Groups the (timestamp, detections) pairs into lists, so that a task only carries the detections of its frames
+    chunk = []
+    for frame in frames:
+        chunk.append(frame)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Per-process state of the anonymization workers, set once by init_anonymization_worker
+_worker_state = {}
+
+def init_anonymization_worker(image_directory, method, variants, copy_undetected, seed, output_options, gray_to_bgr,
+                              timing=False):
+    cv2.setNumThreads(1)
+    if timing:
+        stage_timing.enable()
+    sources = noise_sources(variants)
+    # Forked workers inherit the parent's generator states, so unseeded generators draw fresh entropy
+    if seed is None:
+        np.random.seed()
+    for source in sources:
+        if source.seed is None:
+            source.reseed(None)
+    _worker_state.update(image_directory=image_directory, method=method, variants=variants,
+                         copy_undetected=copy_undetected, seed=seed, sources=sources,
+                         writer=ImageWriter(**output_options), gray_to_bgr=gray_to_bgr)
+
+def run_anonymization_worker(task):
+    first_index, frames = task
+    sources = _worker_state['sources']
+    for source in sources:
+        source.covered_pixels = source.box_pixels = 0
+    writer = _worker_state['writer']
+    stats = anonymize_frames(frames, _worker_state['image_directory'], _worker_state['method'],
+                             _worker_state['variants'], _worker_state['copy_undetected'], writer,
+                             _worker_state['gray_to_bgr'], first_index, _worker_state['seed'])
+    # The chunk is only done once its writes are, so that its write errors stay with it
+    stats['errors'].extend(writer.flush())
+    stats['outputs'] = writer.take_counts()
+    return stats, [(source.covered_pixels, source.box_pixels) for source in sources], stage_timing.take_samples()
+
+
+def anonymize_images(image_directory, detections_file, method, variants, copy_undetected=False, workers=1,
+                     chunk_size=None, seed=None, output_options=None, gray_to_bgr=False, include_absent=False):
+    """
+    Reads every frame listed in the detections file once and writes one anonymized copy per variant.
+
+    Args:
+        variants (list): (output_directory, [operators]) pairs; the operators of a variant are applied in order
+        copy_undetected (bool): Copy frames whose detection list is empty to every output directory unchanged
+        workers (int): Number of worker processes; each takes chunk_size frames at a time and writes them itself
+        chunk_size (int): Frames per task, by default about four tasks per worker and at most 16 frames
+        seed (int): Seed of the global np.random state, from which every frame derives its own, like the generators
+            of seeded noise operators; the output is then the same for any number of workers
+        output_options (dict): Keyword arguments of ImageWriter: image_format, png_compression, link, threaded
+        gray_to_bgr (bool): Expand 2d images to 3 channels before anonymizing them, as the scripts used to
+        include_absent (bool): Also handle the images the detections file does not mention, as frames without
+            detections, i.e. pass them through with copy_undetected
+
+    Returns:
+        dict: images_processed, anonymized_images, copied_images, decodes_avoided, absent_images, the list of
+        errors, in frame order, and the number of outputs written, copied, hard-linked and reflinked
+    """
+    output_options = output_options or {}
+    for output_directory, _ in variants:
+        os.makedirs(output_directory, exist_ok=True)
+
+    stats = {'images_processed': 0, 'anonymized_images': 0, 'copied_images': 0, 'decodes_avoided': 0,
+             'absent_images': 0, 'errors': [], 'outputs': {}}
+    progress = Progress(count_files(image_directory))  # Count number of images to be processed
+    frames = detection_frames(detections_file, image_directory if include_absent else None, stats)
+
+    if workers > 1:
+        if chunk_size is None:
+            chunk_size = max(1, min(16, progress.total // (4 * workers)))
+        sources = noise_sources(variants)
+        with multiprocessing.Pool(workers, initializer=init_anonymization_worker,
+                                  initargs=(image_directory, method, variants, copy_undetected, seed,
+                                            output_options, gray_to_bgr, stage_timing.is_enabled())) as pool:
+            # imap returns the chunks in order, so the errors keep the order of the frames
+            tasks = ((index * chunk_size, chunk) for index, chunk in enumerate(chunk_frames(frames, chunk_size)))
+            for chunk_stats, counters, samples in pool.imap(run_anonymization_worker, tasks):
+                merge_stats(stats, chunk_stats)
+                stage_timing.merge_samples(samples)
+                for source, (covered_pixels, box_pixels) in zip(sources, counters):
+                    source.covered_pixels += covered_pixels
+                    source.box_pixels += box_pixels
+                progress.update(chunk_stats['images_processed'])
+    else:
+        writer = ImageWriter(**output_options)
+        for index, chunk in enumerate(chunk_frames(frames, 1)):
+            frame_stats = anonymize_frames(chunk, image_directory, method, variants, copy_undetected, writer, gray_to_bgr,
+                                           index, seed)
+            merge_stats(stats, frame_stats)
+            progress.update(frame_stats['images_processed'])
+        stats['errors'].extend(writer.close())
+        stats['outputs'] = writer.take_counts()
+
+    progress.finish()
+
+    # Save the list of errors to every output directory
+    for output_directory, _ in variants:
+        with open(os.path.join(output_directory, 'errors.log'), 'w') as f:
+            for item in stats['errors']:
+                f.write("%s\n" % item)
+
+    return stats
+
+
+def add_output_arguments(argparser):
+    argparser.add_argument("--output-format", type=str, choices=IMAGE_FORMATS, default="png",
+                           help="png, lossless webp, or npy for raw arrays")
+    argparser.add_argument("--png-compression", type=int, choices=range(10), default=None, metavar="0-9",
+                           help="zlib level of PNG outputs, 0 is fastest (default: OpenCV's)")
+    argparser.add_argument("--async-write", action="store_true", help="Encode the outputs in a background thread")
+    argparser.add_argument("--link", type=str, choices=LINK_MODES, default="copy",
+                           help="How frames left untouched reach the output directory; hard links and reflinks "
+                                "fall back to a copy where the filesystem does not support them")
+    argparser.add_argument("--passthrough", action="store_true",
+                           help="Link or copy every image without detections to the output, including the images the "
+                                "detections file does not mention, without decoding them")
+    argparser.add_argument("--gray-to-bgr", action="store_true",
+                           help="Expand 2d images to 3 channels before anonymizing and writing them, as before")
+
+
+def writer_options(args):
+    return {'image_format': args.output_format, 'png_compression': args.png_compression, 'link': args.link,
+            'threaded': args.async_write}
+
+
+def print_statistics(stats, variants, elapsed):
+    print(f"\nTotal images processed: {stats['images_processed']}")
+    print(f"Images with detected humans and anonymized: {stats['anonymized_images']}")
+    print(f"Percentage of images with detected humans: "
+          f"{(stats['anonymized_images'] / max(stats['images_processed'], 1)) * 100:.2f}%")
+    if stats['copied_images']:
+        print(f"Images without detections copied unchanged: {stats['copied_images']}")
+    if stats['absent_images']:
+        print(f"Images absent from the detections: {stats['absent_images']}")
+    print(f"Decodes avoided: {stats['decodes_avoided']} of {stats['images_processed']} images")
+    outputs = {key: count for key, count in stats['outputs'].items() if count and key != 'bytes_written'}
+    if outputs:
+        print(f"Output files: {', '.join(f'{count} {key}' for key, count in outputs.items())}")
+    written = stats['outputs'].get('written', 0)
+    if written:
+        print(f"Per anonymized frame: {1000 * elapsed / max(stats['anonymized_images'], 1):.2f} ms, "
+              f"{stats['outputs']['bytes_written'] / written / 1024:.1f} KB per written file")
+    for output_directory, operators in variants:
+        for operator in operators:
+            summary = operator.summary()
+            if summary:
+                print(f"{output_directory} ({operator.describe()}): {summary}")
+    print(f"Error processing images: {len(stats['errors'])}")
+    print(f"Time taken: {elapsed:.2f} seconds")
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description='Anonymize the detection boxes of every image with one or more chains of operators, reading each image once')
+    argparser.add_argument('image_directory', type=str,  help='Path to the directory containing images')
+    argparser.add_argument('json_file', type=str, help='Path to the JSON, JSON Lines (.jsonl) or NumPy (.npd) detection results')
+    argparser.add_argument("method", type=str, help="Method to use for detection (2d or 3d)")
+    argparser.add_argument("--variant", nargs=2, action='append', required=True, metavar=('OUTPUT_DIRECTORY', 'CHAIN'),
+                           help="Output directory and the operators to apply, e.g. out_blur 'blur:sigma=30+noise:epsilon=0.1'. "
+                                f"Operators: {'; '.join(name + '(' + ', '.join(cls.PARAMETERS) + ')' for name, cls in OPERATORS.items())}. "
+                                "Can be given several times")
+    argparser.add_argument("--copy-undetected", action="store_true", help="Copy frames with an empty detection list unchanged")
+    argparser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    add_output_arguments(argparser)
+    stage_timing.add_timing_arguments(argparser)
+
+    args = argparser.parse_args()
+
+    try:
+        variants = [(output_directory, parse_chain(chain)) for output_directory, chain in args.variant]
+    except (ValueError, TypeError) as e:
+        argparser.error(str(e))
+
+    print(f"\nAnonymizing images in {args.image_directory}.")
+    print(f"Detections from: {args.json_file}")
+    print(f"Method: {args.method}")
+    for output_directory, operators in variants:
+        print(f"Save to: {output_directory} <- {' + '.join(operator.describe() for operator in operators)}")
+
+    stage_timing.setup(args)
+
+    # Start timer
+    start_time = time.time()
+
+    with stage_timing.profiled(args.profile):
+        stats = anonymize_images(args.image_directory, args.json_file, args.method, variants,
+                                 args.copy_undetected or args.passthrough, workers=args.workers,
+                                 output_options=writer_options(args), gray_to_bgr=args.gray_to_bgr,
+                                 include_absent=args.passthrough)
+
+    # Stop timer
+    end_time = time.time()
+
+    print_statistics(stats, variants, end_time - start_time)
+    stage_timing.finish(args, stats['images_processed'])
+    print("All images have been processed and anonymized based on detection boxes.")
@@ -0,0 +1,55 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from anonymize_images_JSON import BLUR_ENGINES
+
+
+def synthetic_image(width, height, seed):
+    # Random blobs at several scales, so that the blur has structure to remove
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width, 3), dtype=np.float32)
+    for scale in (2, 8, 32):
+        layer = rng.random((max(1, height // scale), max(1, width // scale), 3), dtype=np.float32)
+        image += cv2.resize(layer, (width, height), interpolation=cv2.INTER_CUBIC)
+    image -= image.min()
+    return (255 * image / image.max()).astype(np.uint8)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the speed and output of the blur engines of anonymize_images_JSON.py")
+    parser.add_argument("--image", type=str, default=None, help="Image to blur instead of a synthetic one")
+    parser.add_argument("--width", type=int, default=200, help="Width of the synthetic region")
+    parser.add_argument("--height", type=int, default=450, help="Height of the synthetic region")
+    parser.add_argument("--sigma", type=int, default=30, help="Sigma value for Gaussian blur")
+    parser.add_argument("--repeats", type=int, default=20, help="Number of timed calls per engine")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic region")
+    args = parser.parse_args()
+
+    if args.image is not None:
+        roi = cv2.imread(args.image)
+        if roi is None:
+            raise Exception(f"Error reading {args.image}")
+    else:
+        roi = synthetic_image(args.width, args.height, args.seed)
+    megapixels = roi.shape[0] * roi.shape[1] / 1e6
+
+    reference = BLUR_ENGINES['gaussian'](roi, args.sigma)
+    print(f"Region {roi.shape[1]}x{roi.shape[0]}, sigma {args.sigma}")
+    reference_time = None
+    for name, engine in BLUR_ENGINES.items():
+        engine(roi, args.sigma)  # Warm-up
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            blurred = engine(roi, args.sigma)
+        elapsed = (time.perf_counter() - start) / args.repeats
+        reference_time = reference_time or elapsed
+
+        difference = np.abs(blurred.astype(np.int16) - reference.astype(np.int16))
+        mse = np.mean(difference.astype(np.float64) ** 2)
+        psnr = float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+        print(f"  {name:10s} {1000 * elapsed:8.2f} ms ({1000 * elapsed / megapixels:8.2f} ms/MP, "
+              f"{reference_time / elapsed:6.2f}x), mean abs diff {difference.mean():6.2f}, "
+              f"max abs diff {difference.max():3d}, PSNR {psnr:6.2f} dB")
@@ -0,0 +1,73 @@
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from anonymize_images_JSON import (add_noise_differential_privacy_rgb_images_gaussian,
+                                   add_noise_differential_privacy_rgb_images_laplace)
+from dp_noise import FastNoise
+
+
+def legacy_noise(noise_type):
+    noise = (add_noise_differential_privacy_rgb_images_laplace if noise_type == 'laplacian'
+             else add_noise_differential_privacy_rgb_images_gaussian)
+
+    def apply(roi, epsilon):
+        roi[...] = noise(roi, epsilon)
+    return apply
+
+
+def fast_noise(noise_type, seed):
+    generator = FastNoise(seed)
+    return generator.add_laplace if noise_type == 'laplacian' else generator.add_gaussian
+
+
+def measure(apply, image, epsilon, repeats):
+    # Returns (seconds per call, peak bytes allocated per call, last output)
+    output = image.copy()
+    apply(output, epsilon)  # Warm-up, lets FastNoise allocate its buffers
+    start = time.perf_counter()
+    for _ in range(repeats):
+        output = image.copy()
+        apply(output, epsilon)
+    elapsed = (time.perf_counter() - start) / repeats
+
+    output = image.copy()
+    tracemalloc.start()
+    apply(output, epsilon)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the legacy and in-place differential-privacy noise paths")
+    parser.add_argument("--width", type=int, default=752, help="Width of the synthetic region")
+    parser.add_argument("--height", type=int, default=480, help="Height of the synthetic region")
+    parser.add_argument("--channels", type=int, default=3, help="Number of channels of the synthetic region")
+    parser.add_argument("--epsilon", type=float, default=10.0, help="Epsilon value for differential privacy")
+    parser.add_argument("--repeats", type=int, default=20, help="Number of timed calls per path")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic region and the noise")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    image = rng.integers(0, 256, (args.height, args.width, args.channels), dtype=np.uint8)
+    megapixels = args.width * args.height / 1e6
+    np.random.seed(args.seed)
+
+    for noise_type in ('laplacian', 'gaussian'):
+        legacy_time, legacy_peak, legacy_output = measure(legacy_noise(noise_type), image, args.epsilon, args.repeats)
+        fast_time, fast_peak, fast_output = measure(fast_noise(noise_type, args.seed), image, args.epsilon, args.repeats)
+
+        # Both paths sample the same distribution, so their output histograms should match up to sampling noise
+        legacy_hist = np.bincount(legacy_output.ravel(), minlength=256) / legacy_output.size
+        fast_hist = np.bincount(fast_output.ravel(), minlength=256) / fast_output.size
+
+        print(f"{noise_type} noise, {args.width}x{args.height}x{args.channels}, epsilon {args.epsilon}:")
+        print(f"  legacy: {1000 * legacy_time / megapixels:.2f} ms/MP, peak {legacy_peak / megapixels / 1e6:.2f} MB/MP")
+        print(f"  fast:   {1000 * fast_time / megapixels:.2f} ms/MP, peak {fast_peak / megapixels / 1e6:.2f} MB/MP")
+        print(f"  speed-up: {legacy_time / fast_time:.2f}x")
+        print(f"  output mean {legacy_output.mean():.2f} vs {fast_output.mean():.2f}, "
+              f"std {legacy_output.std():.2f} vs {fast_output.std():.2f}, "
+              f"histogram L1 distance {np.abs(legacy_hist - fast_hist).sum():.4f}")
@@ -0,0 +1,136 @@
+import argparse
+import time
+
+import numpy as np
+from nnmavmath import geometry
+
+from non_overlapping_detections import (clean_up_rectangles, clean_up_rectangles_pairwise, group_overlapping_detections,
+                                        group_overlapping_detections_pairwise, merge_boxes, non_overlapping_detections_numpy,
+                                        non_overlapping_detections_quadrilateral, split_rectangles)
+from rectangle_checks import connected_components, coverage, partition, random_frame
+
+
+def rectangles_of(detections):
+    rectangles = [geometry.Quadrilateral.rectangle(x, y, width, height) for x, y, width, height, _ in detections]
+    return sorted(rectangles, key=lambda rect: rect.area, reverse=True)
+
+
+def check_grouping(frames):
+    # Returns (sweep seconds, pairwise seconds, frames where the pairwise scan split a connected component)
+    sweep_time = pairwise_time = 0.0
+    split_frames = 0
+    for detections in frames:
+        rectangles = rectangles_of(detections)
+        reference = connected_components(rectangles)
+
+        start = time.perf_counter()
+        sweep = partition(group_overlapping_detections(rectangles), rectangles)
+        sweep_time += time.perf_counter() - start
+        if sweep != reference:
+            raise Exception(f"Sweep grouping differs from the connected components for {detections}")
+
+        start = time.perf_counter()
+        pairwise = partition(group_overlapping_detections_pairwise(list(rectangles)), rectangles)
+        pairwise_time += time.perf_counter() - start
+        if pairwise != sweep:
+            # Every pairwise group has to lie inside one component, it can only miss joins
+            if not all(any(group <= component for component in sweep) for group in pairwise):
+                raise Exception(f"Pairwise grouping joins separate components for {detections}")
+            split_frames += 1
+    return sweep_time, pairwise_time, split_frames
+
+
+def check_clean_up(frames):
+    # Returns (seconds, pairwise seconds, fragments) for cleaning up the split fragments of every group
+    clean_up_time = pairwise_time = 0.0
+    fragment_count = 0
+    for detections in frames:
+        for group in group_overlapping_detections(rectangles_of(detections)):
+            fragments = split_rectangles(clean_up_rectangles(group))
+            fragment_count += len(fragments)
+
+            start = time.perf_counter()
+            remaining = clean_up_rectangles(fragments)
+            clean_up_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            reference = clean_up_rectangles_pairwise(list(fragments))
+            pairwise_time += time.perf_counter() - start
+            if [id(rect) for rect in remaining] != [id(rect) for rect in reference]:
+                raise Exception(f"Clean-up differs from the pairwise clean-up for {detections}")
+    return clean_up_time, pairwise_time, fragment_count
+
+
+def check_decomposition(frames, width, height):
+    # Returns (numpy seconds, quadrilateral seconds, numpy boxes, quadrilateral boxes, merged boxes, frames where the
+    # quadrilateral output overlaps itself)
+    numpy_time = quadrilateral_time = 0.0
+    numpy_boxes = quadrilateral_boxes = merged_boxes = overlapping_frames = 0
+    for detections in frames:
+        start = time.perf_counter()
+        numpy_output = non_overlapping_detections_numpy(detections)
+        numpy_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        quadrilateral_output = non_overlapping_detections_quadrilateral(detections)
+        quadrilateral_time += time.perf_counter() - start
+
+        # Boxes may reach past the frame by half their size
+        offset = 500
+        shape = (height + 2 * offset, width + 2 * offset)
+        union = coverage([detection[:4] for detection in detections], shape, offset) > 0
+        numpy_coverage = coverage(numpy_output, shape, offset)
+        quadrilateral_coverage = coverage(quadrilateral_output, shape, offset)
+        if numpy_coverage.max() > 1 or not np.array_equal(numpy_coverage > 0, union):
+            raise Exception(f"NumPy boxes do not partition the detections for {detections}")
+        if not np.array_equal(quadrilateral_coverage > 0, union):
+            raise Exception(f"Quadrilateral boxes do not cover the detections for {detections}")
+        merged = merge_boxes(numpy_output)
+        merged_coverage = coverage(merged, shape, offset)
+        if merged_coverage.max() > 1 or not np.array_equal(merged_coverage > 0, union):
+            raise Exception(f"Merged boxes do not partition the detections for {detections}")
+        overlapping_frames += quadrilateral_coverage.max() > 1
+        merged_boxes += len(merged)
+        numpy_boxes += len(numpy_output)
+        quadrilateral_boxes += len(quadrilateral_output)
+    return numpy_time, quadrilateral_time, numpy_boxes, quadrilateral_boxes, merged_boxes, overlapping_frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the rectangle grouping, clean-up and decomposition of "
+                                                 "non_overlapping_detections.py with the previous implementations on "
+                                                 "random frames")
+    parser.add_argument("--frames", type=int, default=50, help="Number of random frames")
+    parser.add_argument("--boxes", type=int, nargs="+", default=[5, 20], help="Detections per frame")
+    parser.add_argument("--width", type=int, default=752, help="Width of the synthetic frames")
+    parser.add_argument("--height", type=int, default=480, help="Height of the synthetic frames")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random frames")
+    args = parser.parse_args()
+
+    geometry.GeometryConfig.set_origin('topleft')
+    rng = np.random.default_rng(args.seed)
+
+    for boxes in args.boxes:
+        frames = [random_frame(rng, boxes, args.width, args.height) for _ in range(args.frames)]
+        sweep_time, pairwise_time, split_frames = check_grouping(frames)
+        print(f"{boxes} boxes per frame, {args.frames} frames:")
+        print(f"  grouping: sweep {1000 * sweep_time / args.frames:.3f} ms/frame, "
+              f"pairwise {1000 * pairwise_time / args.frames:.3f} ms/frame, "
+              f"speed-up {pairwise_time / sweep_time:.2f}x")
+        print(f"  sweep groups equal the connected components in all frames, pairwise groups in "
+              f"{args.frames - split_frames}/{args.frames} (the others split a component)")
+
+        clean_up_time, pairwise_time, fragment_count = check_clean_up(frames)
+        print(f"  clean-up of {fragment_count / args.frames:.1f} fragments per frame: "
+              f"{1000 * clean_up_time / args.frames:.3f} ms/frame, pairwise {1000 * pairwise_time / args.frames:.3f} "
+              f"ms/frame, speed-up {pairwise_time / clean_up_time:.2f}x, same rectangles in all frames")
+
+        numpy_time, quadrilateral_time, numpy_boxes, quadrilateral_boxes, merged_boxes, overlapping_frames = \
+            check_decomposition(frames, args.width, args.height)
+        print(f"  decomposition: numpy {1000 * numpy_time / args.frames:.3f} ms/frame, "
+              f"quadrilateral {1000 * quadrilateral_time / args.frames:.3f} ms/frame, "
+              f"speed-up {quadrilateral_time / numpy_time:.2f}x")
+        print(f"  same coverage in all frames, {numpy_boxes / args.frames:.1f} vs {quadrilateral_boxes / args.frames:.1f} "
+              f"boxes per frame, quadrilateral boxes overlap in {overlapping_frames}/{args.frames} frames")
+        print(f"  merged into strips: {merged_boxes / args.frames:.1f} boxes per frame for {boxes} detections, "
+              f"{100 * (1 - merged_boxes / numpy_boxes):.1f}% fewer than the numpy cells")
@@ -0,0 +1,28 @@
+import argparse
+import os
+import time
+
+from detections_io import load_detections, write_detections
+
+
+def path_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert detection results between JSON (.json), JSON Lines (.jsonl) and NumPy (.npd) formats")
+    parser.add_argument("input_file", type=str, help="Detection results to convert, format taken from the extension")
+    parser.add_argument("output_file", type=str, help="Converted detection results, format taken from the extension")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    detections = load_detections(args.input_file)
+    load_time = time.time() - start_time
+    write_detections(detections, args.output_file)
+
+    print(f"Timestamps: {len(detections)}, detections: {sum(len(boxes) for boxes in detections.values())}")
+    print(f"Load time: {load_time:.2f} seconds")
+    print(f"Size: {path_size(args.input_file)} -> {path_size(args.output_file)} bytes")
+    print(f"Detections have been converted and saved to {args.output_file}")
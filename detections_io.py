@@ -0,0 +1,139 @@
+import json
+import os
+
+import numpy as np
+
+# Detection files map a timestamp to its list of [x, y, w, h(, confidence)] boxes. The format is picked from the
+# file extension:
+#   .json   one JSON object, as written by the original scripts
+#   .jsonl  JSON Lines, one {"timestamp": ..., "detections": [...]} object per line, plus a sidecar
+#           <file>.idx holding the byte offset of every timestamp
+#   .npd    a directory of .npy arrays that np.load can memory-map: timestamps (T,), offsets (T + 1,) into
+#           boxes (N, 4) and confidences (N,) float64, NaN for boxes stored without a confidence. Boxes are int32 when
+#           every coordinate is an integer, as the detectors write them, and float64 otherwise (e.g. from
+#           txts_to_JSON.py), so a json -> npd -> json round trip gives back the same values and types
+
+ARRAY_NAMES = ('timestamps', 'offsets', 'boxes', 'confidences')
+
+
+def is_jsonl(path):
+    return os.path.splitext(path)[1].lower() == '.jsonl'
+
+
+def is_npd(path):
+    return os.path.splitext(os.path.normpath(path))[1].lower() == '.npd'
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+def write_detection_arrays(detections, path):
+    timestamps = list(detections)
+    offsets = np.zeros(len(timestamps) + 1, dtype=np.int64)
+    np.cumsum([len(detections[timestamp]) for timestamp in timestamps], out=offsets[1:])
+    flat = [detection for timestamp in timestamps for detection in detections[timestamp]]
+
+    boxes = np.array([detection[:4] for detection in flat]).reshape(-1, 4)
+    if not np.issubdtype(boxes.dtype, np.integer):
+        boxes = boxes.astype(np.float64)
+    elif np.abs(boxes).max(initial=0) < 2 ** 31:
+        boxes = boxes.astype(np.int32)
+    confidences = np.array([detection[4] if len(detection) > 4 else np.nan for detection in flat], dtype=np.float64)
+
+    os.makedirs(path, exist_ok=True)
+    arrays = {'timestamps': np.array(timestamps, dtype=str), 'offsets': offsets, 'boxes': boxes,
+              'confidences': confidences}
+    for name in ARRAY_NAMES:
+        np.save(os.path.join(path, name + '.npy'), arrays[name])
+
+
+def load_detection_arrays(path, mmap_mode='r'):
+    return {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+
+
+def frame_detections(arrays, i):
+    # Detections of the i-th timestamp of a .npd store, in the JSON schema
+    start, end = arrays['offsets'][i], arrays['offsets'][i + 1]
+    boxes = arrays['boxes'][start:end].tolist()
+    confidences = arrays['confidences'][start:end].tolist()
+    return [box + [confidence] if confidence == confidence else box for box, confidence in zip(boxes, confidences)]
+
+
+def write_detections(detections, path, indent=4):
+    # indent only applies to .json output; JSON Lines are always written compactly
+    if is_npd(path):
+        write_detection_arrays(detections, path)
+        return
+    if not is_jsonl(path):
+        with open(path, 'w') as f:
+            json.dump(detections, f, indent=indent)
+        return
+
+    index = {}
+    with open(path, 'wb') as f:
+        for timestamp, boxes in detections.items():
+            index[timestamp] = f.tell()
+            line = json.dumps({'timestamp': timestamp, 'detections': boxes}, separators=(',', ':'))
+            f.write(line.encode() + b"\n")
+    with open(index_path(path), 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+
+
+def iter_detections(path):
+    # Yields (timestamp, detections) pairs; JSON Lines files are read one line at a time, .npd stores are mapped
+    if is_npd(path):
+        arrays = load_detection_arrays(path)
+        for i, timestamp in enumerate(arrays['timestamps'].tolist()):
+            yield timestamp, frame_detections(arrays, i)
+        return
+    if not is_jsonl(path):
+        with open(path, 'r') as f:
+            yield from json.load(f).items()
+        return
+
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry['timestamp'], entry['detections']
+
+
+def load_detections(path):
+    return dict(iter_detections(path))
+
+
+def count_detections(path):
+    # Number of timestamps in the file, without parsing the detections of a JSON Lines file or .npd store
+    if is_npd(path):
+        return len(np.load(os.path.join(path, 'timestamps.npy'), mmap_mode='r'))
+    if not is_jsonl(path):
+        with open(path, 'r') as f:
+            return len(json.load(f))
+    if os.path.exists(index_path(path)):
+        return len(load_index(path))
+    with open(path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def load_index(path):
+    # Maps each timestamp to its byte offset (.jsonl) or row (.npd)
+    if is_npd(path):
+        timestamps = np.load(os.path.join(path, 'timestamps.npy'), mmap_mode='r')
+        return {timestamp: i for i, timestamp in enumerate(timestamps.tolist())}
+    with open(index_path(path), 'r') as f:
+        return json.load(f)
+
+
+def lookup_detections(path, timestamp, index=None):
+    # Reads the detections of a single timestamp of a JSON Lines file or .npd store through its index; None if absent
+    if index is None:
+        index = load_index(path)
+    offset = index.get(timestamp)
+    if offset is None:
+        return None
+    if is_npd(path):
+        return frame_detections(load_detection_arrays(path), offset)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return json.loads(f.readline())['detections']
@@ -3,9 +3,11 @@ import argparse
 import cv2
 import numpy as np
 import os
-import glob
 import time
 
+from image_files import Progress, sorted_files
+import stage_timing
+
 def load_yolo(model_path, config_path):
     net = cv2.dnn.readNet(model_path, config_path)
     layer_names = net.getLayerNames()
@@ -15,10 +17,11 @@ def load_yolo(model_path, config_path):
 def read_image(image_path, method):
     if not method in ['2d', '3d']:
         raise ValueError("Invalid method. Choose either '2d' or '3d'.")
-    if method == '2d':
-        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    else:
-        image = cv2.imread(image_path)
+    with stage_timing.stage('imread'):
+        if method == '2d':
+            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        else:
+            image = cv2.imread(image_path)
 
     if image is None:
         raise Exception(f"Error reading {image_path}")
@@ -31,25 +34,28 @@ def read_image(image_path, method):
 def detect_human_bodies(image_path, yolo_net, output_layers_names, method):
     image = read_image(image_path, method)
 
-    blob = cv2.dnn.blobFromImage(image, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
-    yolo_net.setInput(blob)
-    detections = yolo_net.forward(output_layers_names)
+    with stage_timing.stage('blob'):
+        blob = cv2.dnn.blobFromImage(image, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
+    with stage_timing.stage('forward'):
+        yolo_net.setInput(blob)
+        detections = yolo_net.forward(output_layers_names)
 
     human_bodies = []
-    for detection in detections:
-        for attr in detection:
-            scores = attr[5:]
-            class_id = np.argmax(scores)
-            confidence = scores[class_id]
-            if confidence > 0.7:
-                center_x = int(attr[0] * image.shape[1])
-                center_y = int(attr[1] * image.shape[0])
-                w = int(attr[2] * image.shape[1])
-                h = int(attr[3] * image.shape[0])
-                x = center_x - w // 2
-                y = center_y - h // 2
-                if class_id == 0:
-                    human_bodies.append((x, y, w, h, confidence))
+    with stage_timing.stage('decode'):
+        for detection in detections:
+            for attr in detection:
+                scores = attr[5:]
+                class_id = np.argmax(scores)
+                confidence = scores[class_id]
+                if confidence > 0.7:
+                    center_x = int(attr[0] * image.shape[1])
+                    center_y = int(attr[1] * image.shape[0])
+                    w = int(attr[2] * image.shape[1])
+                    h = int(attr[3] * image.shape[0])
+                    x = center_x - w // 2
+                    y = center_y - h // 2
+                    if class_id == 0:
+                        human_bodies.append((x, y, w, h, confidence))
 
     return human_bodies
 
@@ -61,6 +67,7 @@ if __name__ == "__main__":
     parser.add_argument("--model_file", type=str, help="Path to the YOLOv4 model weights file", default="parameters/yolov4.weights")
     parser.add_argument("--config_file", type=str, help="Path to the YOLOv4 model configuration file", default="parameters/yolov4.cfg")
     parser.add_argument("--silent", help="Suppress output", action="store_true")
+    stage_timing.add_timing_arguments(parser)
 
     args = parser.parse_args()
 
@@ -72,41 +79,45 @@ if __name__ == "__main__":
     os.makedirs(output_detections_directory, exist_ok=True)
     yolo_net, output_layers_names = load_yolo(model_path, config_path)
 
-    # Get list of all images in the directory
-    image_paths = glob.glob(os.path.join(images_directory, "*.png"))
+    # Get list of all images in the directory, in timestamp order
+    image_paths = sorted_files(images_directory)
 
     # Initialize counters and lists for statistics
     images_processed = 0
-    total_images = len([f for f in os.listdir(images_directory)])  # Count number of images to be processed
+    progress = Progress(len(image_paths))
     total_detections = 0
     errors = []
+    stage_timing.setup(args)
 
     # Start timer
     start_time = time.time()
 
     # Process each image in the directory
-    for image_path in image_paths:
-        error_msg=None
-        images_processed += 1
-        print(f"\rProgress: {(100 * images_processed / total_images):.2f}%", end=" ")
-        try:
-            human_bodies = detect_human_bodies(image_path, yolo_net, output_layers_names, method=METHOD)
-            if human_bodies:
-                total_detections += len(human_bodies)
-                detection_path = os.path.join(output_detections_directory, os.path.basename(image_path).replace('.png', '.txt'))
-                with open(detection_path, 'w') as f:
-                    for (x, y, w, h, confidence) in human_bodies:
-                        f.write(f"{x} {y} {w} {h} {confidence}\n")
-            else:
-                error_msg = "No human bodies detected"
-
-        except Exception as e:
-            error_msg = str(e)
-
-        if error_msg:
-            if not args.silent:
-                print(f"\nError processing {image_path}: {error_msg}")
-            errors.append(f"{image_path}: {error_msg}")
+    with stage_timing.profiled(args.profile):
+        for image_path in image_paths:
+            error_msg=None
+            images_processed += 1
+            try:
+                human_bodies = detect_human_bodies(image_path, yolo_net, output_layers_names, method=METHOD)
+                if human_bodies:
+                    total_detections += len(human_bodies)
+                    detection_path = os.path.join(output_detections_directory, os.path.basename(image_path).replace('.png', '.txt'))
+                    with stage_timing.stage('write_detections'):
+                        with open(detection_path, 'w') as f:
+                            for (x, y, w, h, confidence) in human_bodies:
+                                f.write(f"{x} {y} {w} {h} {confidence}\n")
+                else:
+                    error_msg = "No human bodies detected"
+
+            except Exception as e:
+                error_msg = str(e)
+
+            if error_msg:
+                if not args.silent:
+                    print(f"\nError processing {image_path}: {error_msg}")
+                errors.append(f"{image_path}: {error_msg}")
+            progress.update()
+        progress.finish()
 
     # Stop timer
     end_time = time.time()
@@ -117,6 +128,7 @@ if __name__ == "__main__":
     print(f"Average detections per image: {total_detections / images_processed:.2f}")
     print(f"Error processing images: {len(errors)}")
     print(f"Time taken: {end_time - start_time:.2f} seconds")
+    stage_timing.finish(args, images_processed)
 
     # Optional: Save the list of errors to a file
     with open(os.path.join(output_detections_directory, 'errors.log'), 'w') as f:
@@ -1,11 +1,21 @@
 import argparse
+import hashlib
+import multiprocessing
+import queue
+import threading
 import cv2
 import numpy as np
 import os
-import glob
 import time
 import json
 
+from detections_io import write_detections
+from image_files import Progress, sorted_files
+import stage_timing
+
+# Minimum person score kept by the decoders
+CONFIDENCE_THRESHOLD = 0.7
+
 def load_yolo(model_path, config_path):
     net = cv2.dnn.readNet(model_path, config_path)
     layer_names = net.getLayerNames()
@@ -15,115 +25,596 @@ def load_yolo(model_path, config_path):
 def read_image(image_path, method):
     if not method in ['2d', '3d']:
         raise ValueError("Invalid method. Choose either '2d' or '3d'.")
-    if method == '2d':
-        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    else:
-        image = cv2.imread(image_path)
+    with stage_timing.stage('imread'):
+        if method == '2d':
+            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        else:
+            image = cv2.imread(image_path)
 
     if image is None:
         raise Exception(f"Error reading {image_path}")
 
-    if method == '2d':
-        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-
+    # 2d images stay single-channel, image_blob expands them to the 3 channels of the network
     return image
 
-def detect_human_bodies(image_path, yolo_net, output_layers_names, method):
-    image = read_image(image_path, method)
-
-    blob = cv2.dnn.blobFromImage(image, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
-    yolo_net.setInput(blob)
-    detections = yolo_net.forward(output_layers_names)
+def image_blob(images):
+    # Resizing and scaling one channel and repeating the result gives the blob of the GRAY2BGR-converted images
+    with stage_timing.stage('blob'):
+        blob = cv2.dnn.blobFromImages(images, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
+        if blob.shape[1] == 1:
+            blob = np.repeat(blob, 3, axis=1)
+    return blob
 
+def decode_detections_loop(detections, image_shape):
     human_bodies = []
     for detection in detections:
         for attr in detection:
             scores = attr[5:]
             class_id = np.argmax(scores)
             confidence = scores[class_id]
-            if confidence > 0.7:
-                center_x = int(attr[0] * image.shape[1])
-                center_y = int(attr[1] * image.shape[0])
-                w = int(attr[2] * image.shape[1])
-                h = int(attr[3] * image.shape[0])
+            if confidence > CONFIDENCE_THRESHOLD:
+                center_x = int(attr[0] * image_shape[1])
+                center_y = int(attr[1] * image_shape[0])
+                w = int(attr[2] * image_shape[1])
+                h = int(attr[3] * image_shape[0])
                 x = center_x - w // 2
                 y = center_y - h // 2
                 if class_id == 0:
-                    human_bodies.append((x, y, w, h, confidence))
+                    human_bodies.append((x, y, w, h, float(confidence)))
+
+    return human_bodies
+
+def decode_detections(detections, image_shape):
+    rows = np.concatenate([detection.reshape(-1, detection.shape[-1]) for detection in detections])
+    scores = rows[:, 5:]
+    person_scores = scores[:, 0]
+    # np.argmax returns the first maximum, so class 0 wins unless another class scores strictly higher
+    mask = (person_scores > CONFIDENCE_THRESHOLD) & (person_scores >= scores[:, 1:].max(axis=1))
+
+    boxes = rows[mask, :4].astype(np.float64)
+    center_x = (boxes[:, 0] * image_shape[1]).astype(int)
+    center_y = (boxes[:, 1] * image_shape[0]).astype(int)
+    w = (boxes[:, 2] * image_shape[1]).astype(int)
+    h = (boxes[:, 3] * image_shape[0]).astype(int)
+    x = center_x - w // 2
+    y = center_y - h // 2
+
+    return list(zip(x.tolist(), y.tolist(), w.tolist(), h.tolist(), person_scores[mask].tolist()))
 
+DECODERS = {'numpy': decode_detections, 'loop': decode_detections_loop}
+
+def non_max_suppression(human_bodies, iou_threshold, score_threshold=0.0):
+    # Greedy NMS over (x, y, w, h, confidence) tuples; the kept boxes are returned in their original order
+    if not human_bodies:
+        return []
+    boxes = np.array([body[:4] for body in human_bodies], dtype=np.float64)
+    scores = np.array([body[4] for body in human_bodies], dtype=np.float64)
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    candidates = np.flatnonzero(scores >= score_threshold)
+    order = candidates[np.argsort(-scores[candidates], kind='stable')]
+    keep = []
+    while order.size > 0:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        inter_w = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        union = areas[best] + areas[rest] - inter
+        iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        order = rest[iou <= iou_threshold]
+
+    return [human_bodies[i] for i in sorted(keep)]
+
+def forward_and_decode(blob, yolo_net, output_layers_names, decode, timings=None):
+    # decode is called with the raw forward outputs; forward and decode time are accumulated separately
+    forward_start = time.perf_counter()
+    yolo_net.setInput(blob)
+    detections = yolo_net.forward(output_layers_names)
+    decode_start = time.perf_counter()
+    human_bodies = decode(detections)
+    stage_timing.record('forward', decode_start - forward_start)
+    stage_timing.record('decode', time.perf_counter() - decode_start)
+    if timings is not None:
+        timings['forward'] = timings.get('forward', 0.0) + decode_start - forward_start
+        timings['decode'] = timings.get('decode', 0.0) + time.perf_counter() - decode_start
     return human_bodies
 
+def detect_human_bodies(image_path, yolo_net, output_layers_names, method, decoder=decode_detections, timings=None):
+    image = read_image(image_path, method)
+
+    blob = image_blob([image])
+
+    return forward_and_decode(blob, yolo_net, output_layers_names,
+                              lambda detections: decoder(detections, image.shape), timings)
+
+def split_batch_detections(detections, batch_len):
+    # Depending on the OpenCV version the region layers return either (N, rows, attrs) or (N * rows, attrs)
+    per_image = [[] for _ in range(batch_len)]
+    for detection in detections:
+        if detection.ndim == 2:
+            detection = detection.reshape(batch_len, -1, detection.shape[-1])
+        for i in range(batch_len):
+            per_image[i].append(detection[i])
+    return per_image
+
+def prepare_batch(image_paths, method):
+    # Reads the images and stacks them into one blob; unreadable images are returned as {image_path: exception}
+    read_errors = {}
+    images = []
+    read_paths = []
+    for image_path in image_paths:
+        try:
+            images.append(read_image(image_path, method))
+            read_paths.append(image_path)
+        except Exception as e:
+            read_errors[image_path] = e
+
+    blob = None
+    if images:
+        blob = image_blob(images)
+    return blob, read_paths, [image.shape for image in images], read_errors
+
+def decode_batch(detections, image_shapes, decoder=decode_detections):
+    return [decoder(image_detections, image_shape)
+            for image_shape, image_detections in zip(image_shapes, split_batch_detections(detections, len(image_shapes)))]
+
+def detect_human_bodies_batch(image_paths, yolo_net, output_layers_names, method, decoder=decode_detections, timings=None):
+    # Returns one entry per image path: either the list of detections or the exception raised while reading it
+    blob, read_paths, image_shapes, results = prepare_batch(image_paths, method)
+
+    if blob is not None:
+        batch_bodies = forward_and_decode(blob, yolo_net, output_layers_names,
+                                          lambda detections: decode_batch(detections, image_shapes, decoder), timings)
+        results.update(zip(read_paths, batch_bodies))
+
+    return [results[image_path] for image_path in image_paths]
+
+def detect_image_batch(batch_paths, yolo_net, output_layers_names, method, decoder=decode_detections, timings=None):
+    # Like detect_human_bodies_batch, but a failure of the whole batch is reported for each of its images
+    try:
+        if len(batch_paths) == 1:
+            return [detect_human_bodies(batch_paths[0], yolo_net, output_layers_names, method,
+                                        decoder=decoder, timings=timings)]
+        return detect_human_bodies_batch(batch_paths, yolo_net, output_layers_names, method,
+                                         decoder=decoder, timings=timings)
+    except Exception as e:
+        return [e] * len(batch_paths)
+
+# Per-process state of the --workers pool, filled once by init_detection_worker
+_worker_state = {}
+
+def init_detection_worker(model_path, config_path, method, decoder_name, num_threads, timing=False):
+    cv2.setNumThreads(num_threads)
+    if timing:
+        stage_timing.enable()
+    yolo_net, output_layers_names = load_yolo(model_path, config_path)
+    _worker_state.update(yolo_net=yolo_net, output_layers_names=output_layers_names,
+                         method=method, decoder=DECODERS[decoder_name])
+
+def run_detection_worker(batch_paths):
+    timings = {'forward': 0.0, 'decode': 0.0}
+    batch_results = detect_image_batch(batch_paths, _worker_state['yolo_net'], _worker_state['output_layers_names'],
+                                       _worker_state['method'], decoder=_worker_state['decoder'], timings=timings)
+    # OpenCV exceptions do not always survive pickling, so only their message is sent back
+    batch_results = [Exception(str(result)) if isinstance(result, Exception) else result for result in batch_results]
+    return batch_results, timings, stage_timing.take_samples()
+
+def run_detection_pipeline(batches, yolo_net, output_layers_names, method, on_batch, decoder=decode_detections,
+                           num_readers=2, prefetch=4, timings=None):
+    """
+    Streams batches of image paths through three stages: reader threads decode the images and build the blobs,
+    the calling thread runs the forward passes and a postprocess thread decodes the outputs.
+
+    Args:
+        batches (list): Lists of image paths, one forward pass each
+        on_batch (callable): Called as on_batch(batch_paths, batch_results) from the postprocess thread, in batch order
+        num_readers (int): Number of reader threads
+        prefetch (int): Maximum number of prepared batches waiting for inference (and of outputs waiting for decoding)
+
+    Returns:
+        dict: Seconds each stage spent waiting on its neighbours and the depth of the prefetch queue
+    """
+    batch_queue = queue.Queue()
+    for item in enumerate(batches):
+        batch_queue.put(item)
+    prepared_queue = queue.Queue(maxsize=prefetch)
+    output_queue = queue.Queue(maxsize=prefetch)
+    stats = {'reader_blocked': 0.0, 'inference_starved': 0.0, 'inference_blocked': 0.0, 'postprocess_starved': 0.0,
+             'prefetch_depth_total': 0, 'prefetch_depth_max': 0, 'prefetch_samples': 0}
+    stats_lock = threading.Lock()
+    postprocess_error = []
+
+    def read_batches():
+        while True:
+            try:
+                index, batch_paths = batch_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                prepared = prepare_batch(batch_paths, method)
+            except Exception as e:
+                prepared = (None, [], [], {image_path: e for image_path in batch_paths})
+            wait_start = time.perf_counter()
+            prepared_queue.put((index, batch_paths, prepared))
+            with stats_lock:
+                stats['reader_blocked'] += time.perf_counter() - wait_start
+        prepared_queue.put(None)
+
+    def postprocess():
+        pending = {}
+        next_index = 0
+        while True:
+            wait_start = time.perf_counter()
+            item = output_queue.get()
+            stats['postprocess_starved'] += time.perf_counter() - wait_start
+            if item is None:
+                break
+            if postprocess_error:
+                continue
+            index, batch_paths, (read_paths, image_shapes, results), detections = item
+            decode_start = time.perf_counter()
+            try:
+                if isinstance(detections, Exception):
+                    results.update((image_path, detections) for image_path in read_paths)
+                elif detections is not None:
+                    results.update(zip(read_paths, decode_batch(detections, image_shapes, decoder)))
+                    stage_timing.record('decode', time.perf_counter() - decode_start)
+                if timings is not None:
+                    timings['decode'] = timings.get('decode', 0.0) + time.perf_counter() - decode_start
+
+                # Readers finish out of order, so batches are held back until all earlier ones have been handed on
+                pending[index] = (batch_paths, [results[image_path] for image_path in batch_paths])
+                while next_index in pending:
+                    on_batch(*pending.pop(next_index))
+                    next_index += 1
+            except Exception as e:
+                postprocess_error.append(e)
+
+    readers = [threading.Thread(target=read_batches, daemon=True) for _ in range(num_readers)]
+    postprocessor = threading.Thread(target=postprocess, daemon=True)
+    for thread in readers + [postprocessor]:
+        thread.start()
+
+    finished_readers = 0
+    while finished_readers < num_readers:
+        depth = prepared_queue.qsize()
+        stats['prefetch_depth_total'] += depth
+        stats['prefetch_depth_max'] = max(stats['prefetch_depth_max'], depth)
+        stats['prefetch_samples'] += 1
+        wait_start = time.perf_counter()
+        item = prepared_queue.get()
+        stats['inference_starved'] += time.perf_counter() - wait_start
+        if item is None:
+            finished_readers += 1
+            continue
+
+        index, batch_paths, (blob, read_paths, image_shapes, read_errors) = item
+        detections = None
+        if blob is not None:
+            forward_start = time.perf_counter()
+            try:
+                yolo_net.setInput(blob)
+                detections = yolo_net.forward(output_layers_names)
+                stage_timing.record('forward', time.perf_counter() - forward_start)
+            except Exception as e:
+                detections = e
+            if timings is not None:
+                timings['forward'] = timings.get('forward', 0.0) + time.perf_counter() - forward_start
+
+        wait_start = time.perf_counter()
+        output_queue.put((index, batch_paths, (read_paths, image_shapes, read_errors), detections))
+        stats['inference_blocked'] += time.perf_counter() - wait_start
+
+    output_queue.put(None)
+    postprocessor.join()
+    if postprocess_error:
+        raise postprocess_error[0]
+    return stats
+
+def detection_fingerprint(model_path, config_path, method):
+    # Anything that changes the raw detections of an image invalidates the cache
+    fingerprint = {'method': method, 'input_size': 416, 'confidence_threshold': CONFIDENCE_THRESHOLD}
+    for name, path in (('model', model_path), ('config', config_path)):
+        stat = os.stat(path)
+        fingerprint[name] = [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+class DetectionCache:
+    """
+    Append-only JSON Lines cache of the raw (pre-NMS) detections of each image, used to resume interrupted runs.
+
+    The first line holds the detection fingerprint; a cache written with another fingerprint is discarded.
+    Every other line records one image, keyed by its absolute path and either its size and mtime ('stat')
+    or the SHA-1 of its content ('hash'). Lines are flushed to disk every checkpoint_every images.
+    """
+
+    def __init__(self, cache_path, fingerprint, key_mode='stat', checkpoint_every=100):
+        self.cache_path = cache_path
+        self.key_mode = key_mode
+        self.checkpoint_every = checkpoint_every
+        self.entries = {}
+        self.keys = {}
+        self.unsaved = 0
+
+        header = {'fingerprint': fingerprint, 'key_mode': key_mode}
+        valid_size = 0
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r') as f:
+                try:
+                    header_matches = json.loads(f.readline() or 'null') == header
+                except json.JSONDecodeError:
+                    header_matches = False
+                if header_matches:
+                    valid_size = f.tell()
+                    for line in iter(f.readline, ''):
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            break  # The run was killed while writing this line
+                        self.entries[entry['path']] = entry
+                        valid_size = f.tell()
+
+        if valid_size:
+            # Drop a partially written last line before appending to the cache
+            os.truncate(cache_path, valid_size)
+            self.file = open(cache_path, 'a')
+        else:
+            self.file = open(cache_path, 'w')
+            self.file.write(json.dumps(header) + "\n")
+
+    def image_key(self, image_path):
+        image_path = os.path.abspath(image_path)
+        if image_path not in self.keys:
+            if self.key_mode == 'hash':
+                with open(image_path, 'rb') as f:
+                    self.keys[image_path] = hashlib.sha1(f.read()).hexdigest()
+            else:
+                stat = os.stat(image_path)
+                self.keys[image_path] = f"{stat.st_size}:{stat.st_mtime_ns}"
+        return self.keys[image_path]
+
+    def lookup(self, image_path):
+        entry = self.entries.get(os.path.abspath(image_path))
+        if entry is None or entry['key'] != self.image_key(image_path):
+            return None
+        return [tuple(body) for body in entry['detections']]
+
+    def store(self, image_path, human_bodies):
+        entry = {'path': os.path.abspath(image_path), 'key': self.image_key(image_path), 'detections': human_bodies}
+        self.entries[entry['path']] = entry
+        self.file.write(json.dumps(entry) + "\n")
+        self.unsaved += 1
+        if self.unsaved >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsaved = 0
+
+    def close(self):
+        self.checkpoint()
+        self.file.close()
+
+    def split_cached(self, image_paths):
+        # Returns ({image_path: cached detections}, [image paths that still need detection])
+        cached = {}
+        uncached = []
+        for image_path in image_paths:
+            try:
+                human_bodies = self.lookup(image_path)
+            except OSError:
+                human_bodies = None
+            if human_bodies is None:
+                uncached.append(image_path)
+            else:
+                cached[image_path] = human_bodies
+        return cached, uncached
+
+class DetectionResults:
+    def __init__(self, total_images, nms_iou=None, score_threshold=0.7, silent=False, show_progress=True, cache=None):
+        self.total_images = total_images
+        self.nms_iou = nms_iou
+        self.score_threshold = score_threshold
+        self.silent = silent
+        self.progress = Progress(total_images, enabled=show_progress)
+        self.cache = cache
+        self.images_processed = 0
+        self.total_detections = 0
+        self.nms_input_boxes = 0
+        self.errors = []
+        self.error_paths = []
+        self.all_detections = {}
+
+    def add_batch(self, batch_paths, batch_results):
+        # Fresh results are recorded in the cache, if any; cached results are replayed through add directly
+        for image_path, human_bodies in zip(batch_paths, batch_results):
+            if self.cache is not None and not isinstance(human_bodies, Exception):
+                self.cache.store(image_path, human_bodies)
+            self.add(image_path, human_bodies)
+
+    def add(self, image_path, human_bodies):
+        error_msg = None
+        self.images_processed += 1
+        self.progress.update()
+        if isinstance(human_bodies, Exception):
+            error_msg = str(human_bodies)
+        else:
+            if self.nms_iou is not None:
+                self.nms_input_boxes += len(human_bodies)
+                with stage_timing.stage('nms'):
+                    human_bodies = non_max_suppression(human_bodies, self.nms_iou, self.score_threshold)
+            if human_bodies:
+                self.total_detections += len(human_bodies)
+                timestamp = os.path.basename(image_path).replace('.png', '')
+                self.all_detections[timestamp] = human_bodies
+            else:
+                error_msg = "No human bodies detected"
+
+        if error_msg:
+            if not self.silent:
+                print(f"\nError processing {image_path}: {error_msg}")
+            self.errors.append(f"{image_path}: {error_msg}")
+            self.error_paths.append(image_path)
+
+    def reorder(self, image_paths):
+        # Restores the order of image_paths after cached and new images were added separately
+        position = {image_path: i for i, image_path in enumerate(image_paths)}
+        timestamps = [os.path.basename(image_path).replace('.png', '') for image_path in image_paths]
+        self.all_detections = {timestamp: self.all_detections[timestamp]
+                               for timestamp in timestamps if timestamp in self.all_detections}
+        order = sorted(range(len(self.errors)), key=lambda i: position.get(self.error_paths[i], len(position)))
+        self.errors = [self.errors[i] for i in order]
+        self.error_paths = [self.error_paths[i] for i in order]
+
+    def save(self, output_detections_file):
+        # The error log is written next to the detections file
+        with stage_timing.stage('write_detections'):
+            write_detections(self.all_detections, output_detections_file)
+
+        error_log_path = os.path.join(os.path.dirname(output_detections_file), 'errors.log')
+        with open(error_log_path, 'w') as f:
+            for item in self.errors:
+                f.write("%s\n" % item)
+
+def run_cached_detections(image_paths, batch_size, results, run_batches):
+    # Replays the cached images, runs run_batches(batches) on the rest and restores the directory order
+    uncached_paths = image_paths
+    if results.cache is not None:
+        cached, uncached_paths = results.cache.split_cached(image_paths)
+        for image_path, human_bodies in cached.items():
+            results.add(image_path, human_bodies)
+
+    batches = [uncached_paths[i:i + batch_size] for i in range(0, len(uncached_paths), batch_size)]
+    try:
+        outcome = run_batches(batches)
+    finally:
+        if results.cache is not None:
+            results.cache.close()
+    if len(uncached_paths) != len(image_paths):
+        results.reorder(image_paths)
+    return outcome, len(image_paths) - len(uncached_paths)
+
+def run_detections(batches, results, yolo_net, output_layers_names, method, decoder=decode_detections, timings=None,
+                   pipeline=False, num_readers=2, prefetch=4):
+    # Runs every batch through an already loaded net; returns the pipeline stats in pipeline mode, None otherwise
+    if pipeline:
+        return run_detection_pipeline(batches, yolo_net, output_layers_names, method, results.add_batch,
+                                      decoder=decoder, num_readers=num_readers, prefetch=prefetch, timings=timings)
+    for batch_paths in batches:
+        results.add_batch(batch_paths, detect_image_batch(batch_paths, yolo_net, output_layers_names, method,
+                                                          decoder=decoder, timings=timings))
+    return None
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Detect human bodies in images using YOLOv4")
     parser.add_argument("images_directory", type=str, help="Path to the directory containing images to be processed")
-    parser.add_argument("output_detections_file", type=str, help="Path to the file for saving detection results in JSON format")
+    parser.add_argument("output_detections_file", type=str, help="Path to the file for saving detection results in JSON format (.jsonl for JSON Lines, .npd for NumPy arrays)")
     parser.add_argument("method", type=str, help="Method to use for detection (2d or 3d)", default="2d")
     parser.add_argument("--model_file", type=str, help="Path to the YOLOv4 model weights file", default="parameters/yolov4.weights")
     parser.add_argument("--config_file", type=str, help="Path to the YOLOv4 model configuration file", default="parameters/yolov4.cfg")
+    parser.add_argument("--batch-size", type=int, help="Number of images stacked into one forward pass", default=1)
+    parser.add_argument("--decoder", type=str, choices=list(DECODERS), help="YOLO output decoder", default="numpy")
+    parser.add_argument("--nms-iou", type=float, help="Enable non-maximum suppression with this IoU threshold", default=None)
+    parser.add_argument("--score-threshold", type=float, help="Minimum confidence kept by non-maximum suppression", default=0.7)
+    parser.add_argument("--workers", type=int, help="Number of worker processes, each loading its own copy of the model", default=1)
+    parser.add_argument("--pipeline", help="Overlap image reading, inference and decoding in separate stages", action="store_true")
+    parser.add_argument("--readers", type=int, help="Number of image reader threads in --pipeline mode", default=2)
+    parser.add_argument("--prefetch", type=int, help="Maximum number of prepared batches queued in --pipeline mode", default=4)
+    parser.add_argument("--resume", help="Cache per-image detections next to the output file and skip images already done", action="store_true")
+    parser.add_argument("--cache-key", type=str, choices=['stat', 'hash'], help="Identify cached images by size and mtime or by content hash", default="stat")
+    parser.add_argument("--checkpoint-every", type=int, help="Flush the detection cache to disk every N images in --resume mode", default=100)
     parser.add_argument("--silent", help="Suppress output", action="store_true")
+    stage_timing.add_timing_arguments(parser)
 
     args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.pipeline and args.workers > 1:
+        parser.error("--pipeline cannot be combined with --workers")
+    if args.readers < 1 or args.prefetch < 1:
+        parser.error("--readers and --prefetch must be at least 1")
 
     METHOD = args.method
     model_path = args.model_file
     config_path = args.config_file
     images_directory = args.images_directory
     output_detections_file = args.output_detections_file
-    yolo_net, output_layers_names = load_yolo(model_path, config_path)
 
-    # Get list of all images in the directory
-    image_paths = glob.glob(os.path.join(images_directory, "*.png"))
+    # Get list of all images in the directory, in timestamp order
+    image_paths = sorted_files(images_directory)
 
     # Initialize counters and lists for statistics
-    images_processed = 0
-    total_images = len([f for f in os.listdir(images_directory)])  # Count number of images to be processed
-    total_detections = 0
-    errors = []
-    all_detections = {}
+    total_images = len(image_paths)  # Count number of images to be processed
+    cache = None
+    if args.resume:
+        cache_path = os.path.splitext(output_detections_file)[0] + '.cache.jsonl'
+        cache = DetectionCache(cache_path, detection_fingerprint(model_path, config_path, METHOD),
+                               args.cache_key, args.checkpoint_every)
+    results = DetectionResults(total_images, args.nms_iou, args.score_threshold, args.silent, cache=cache)
+    timings = {'forward': 0.0, 'decode': 0.0}
+    decoder = DECODERS[args.decoder]
+    stage_timing.setup(args)
 
     # Start timer
     start_time = time.time()
 
-    # Process each image in the directory
-    for image_path in image_paths:
-        error_msg = None
-        images_processed += 1
-        print(f"\rProgress: {(100 * images_processed / total_images):.2f}%", end=" ")
-        try:
-            human_bodies = detect_human_bodies(image_path, yolo_net, output_layers_names, method=METHOD)
-            if human_bodies:
-                total_detections += len(human_bodies)
-                timestamp = os.path.basename(image_path).replace('.png', '')
-                all_detections[timestamp] = human_bodies
-            else:
-                error_msg = "No human bodies detected"
+    # Process the images in the directory, args.batch_size images per forward pass
+    def run_batches(batches):
+        if not batches:
+            return None
+        if args.workers > 1:
+            # Workers pull batches from the pool's task queue; imap hands the results back in submission order
+            with multiprocessing.Pool(args.workers, initializer=init_detection_worker,
+                                      initargs=(model_path, config_path, METHOD, args.decoder,
+                                                max(1, os.cpu_count() // args.workers),
+                                                stage_timing.is_enabled())) as pool:
+                for batch_paths, (batch_results, batch_timings, samples) in zip(batches, pool.imap(run_detection_worker, batches)):
+                    for stage, seconds in batch_timings.items():
+                        timings[stage] += seconds
+                    stage_timing.merge_samples(samples)
+                    results.add_batch(batch_paths, batch_results)
+            return None
+        yolo_net, output_layers_names = load_yolo(model_path, config_path)
+        return run_detections(batches, results, yolo_net, output_layers_names, METHOD, decoder=decoder,
+                              timings=timings, pipeline=args.pipeline, num_readers=args.readers,
+                              prefetch=args.prefetch)
 
-        except Exception as e:
-            error_msg = str(e)
-
-        if error_msg:
-            if not args.silent:
-                print(f"\nError processing {image_path}: {error_msg}")
-            errors.append(f"{image_path}: {error_msg}")
+    with stage_timing.profiled(args.profile):
+        pipeline_stats, cached_images = run_cached_detections(image_paths, args.batch_size, results, run_batches)
 
     # Stop timer
     end_time = time.time()
 
-    # Write all detections to a JSON file
-    with open(output_detections_file, 'w') as json_file:
-        json.dump(all_detections, json_file, indent=4)
+    # Write all detections to a JSON file, and the list of errors next to it
+    results.save(output_detections_file)
 
     # Print detailed statistics
-    print(f"Total images processed: {images_processed}")
-    print(f"Total detections made: {total_detections}")
-    print(f"Average detections per image: {total_detections / images_processed:.2f}")
-    print(f"Error processing images: {len(errors)}")
+    print(f"Total images processed: {results.images_processed}")
+    if args.resume:
+        print(f"Images restored from the detection cache: {cached_images}")
+    print(f"Total detections made: {results.total_detections}")
+    print(f"Average detections per image: {results.total_detections / results.images_processed:.2f}")
+    if args.nms_iou is not None:
+        nms_removed = results.nms_input_boxes - results.total_detections
+        print(f"NMS (IoU {args.nms_iou}, score {args.score_threshold}) removed {nms_removed} of {results.nms_input_boxes} boxes"
+              f" ({100 * nms_removed / max(results.nms_input_boxes, 1):.2f}%)")
+    print(f"Error processing images: {len(results.errors)}")
     print(f"Time taken: {end_time - start_time:.2f} seconds")
-
-    # Optional: Save the list of errors to a file
-    error_log_path = os.path.join(os.path.dirname(output_detections_file), 'errors.log')
-    with open(error_log_path, 'w') as f:
-        for item in errors:
-            f.write("%s\n" % item)
+    print(f"Forward time: {timings['forward']:.2f} seconds, decode time ({args.decoder}): {timings['decode']:.2f} seconds")
+    print(f"Throughput (batch size {args.batch_size}, {args.workers} worker(s)): {results.images_processed / (end_time - start_time):.2f} images/sec")
+    if pipeline_stats is not None:
+        print(f"Pipeline waits: readers blocked {pipeline_stats['reader_blocked']:.2f}s, "
+              f"inference starved {pipeline_stats['inference_starved']:.2f}s, "
+              f"inference blocked {pipeline_stats['inference_blocked']:.2f}s, "
+              f"postprocess starved {pipeline_stats['postprocess_starved']:.2f}s")
+        print(f"Prefetch queue depth: mean {pipeline_stats['prefetch_depth_total'] / max(pipeline_stats['prefetch_samples'], 1):.2f}, "
+              f"max {pipeline_stats['prefetch_depth_max']} of {args.prefetch}")
+    stage_timing.finish(args, results.images_processed)
 
     print("All images have been processed and detection results are saved.")
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+
+
+def timestamp_key(name):
+    # Numeric EuRoC/ADVIO-style names sort by timestamp (digit strings of equal length compare like the numbers),
+    # anything else by name after them
+    stem = name.rpartition(os.sep)[2].partition('.')[0]
+    return (not stem.isdigit(), len(stem), stem)
+
+
+def scan_files(directory, extension='.png'):
+    # Lazily yields the paths of the files with the given extension, in directory order, from a single os.scandir
+    # pass; entry.is_file() is answered from the directory entry itself, so no file is stat'ed
+    extension = extension.lower()
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(extension) and entry.is_file():
+                yield entry.path
+
+
+def sorted_files(directory, extension='.png'):
+    # Like scan_files, in timestamp order
+    return sorted(scan_files(directory, extension), key=timestamp_key)
+
+
+def count_files(directory, extension='.png'):
+    # Only files with the extension count, so errors.log and other files next to the images do not skew progress
+    return sum(1 for _ in scan_files(directory, extension))
+
+
+class Progress:
+    """
+    "\\rProgress: xx.xx% (done/total)" line, redrawn at most every `interval` seconds and once at the end.
+    """
+
+    def __init__(self, total, interval=0.5, enabled=True, label='Progress'):
+        self.total = max(total, 1)
+        self.interval = interval
+        self.enabled = enabled
+        self.label = label
+        self.done = 0
+        self.last_print = None
+
+    def show(self):
+        print(f"\r{self.label}: {100 * self.done / self.total:.2f}% ({self.done}/{self.total})", end=" ")
+        sys.stdout.flush()
+
+    def update(self, count=1):
+        self.done += count
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if self.last_print is None or now - self.last_print >= self.interval or self.done >= self.total:
+            self.last_print = now
+            self.show()
+
+    def finish(self):
+        # Shows the final count when the last update was throttled, e.g. when fewer items than expected came
+        if self.enabled and self.done < self.total:
+            self.show()
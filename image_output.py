@@ -0,0 +1,151 @@
+import fcntl
+import os
+import queue
+import shutil
+import threading
+
+import cv2
+import numpy as np
+
+import stage_timing
+
+# Output formats of the anonymization scripts:
+#   png   cv2.imwrite, with an optional zlib level (0 = fastest, 9 = smallest)
+#   webp  lossless WebP, usually smaller than PNG but slower to encode
+#   npy   the raw array as written by np.save, no compression at all
+IMAGE_FORMATS = ('png', 'webp', 'npy')
+
+# How frames that are not anonymized reach the output directory
+LINK_MODES = ('copy', 'hardlink', 'reflink')
+
+# ioctl request that makes a copy-on-write clone of a file on btrfs, XFS and other filesystems supporting it
+FICLONE = 0x40049409
+
+
+def reflink(source_path, output_path):
+    with open(source_path, 'rb') as source, open(output_path, 'wb') as output:
+        fcntl.ioctl(output.fileno(), FICLONE, source.fileno())
+
+
+def remove_output(output_path):
+    # An output left by an earlier run may be a hard link to its input frame; writing through it would overwrite the
+    # input, and copying the input onto it fails, so it is unlinked first
+    if os.path.lexists(output_path):
+        os.remove(output_path)
+
+
+def link_file(source_path, output_path, mode='copy'):
+    # Returns the mode actually used; hard links and reflinks fall back to a copy where the filesystem refuses them
+    remove_output(output_path)
+    if mode != 'copy':
+        try:
+            if mode == 'hardlink':
+                os.link(source_path, output_path)
+            else:
+                reflink(source_path, output_path)
+            return mode
+        except OSError:
+            pass
+    shutil.copy(source_path, output_path)
+    return 'copy'
+
+
+class ImageWriter:
+    """
+    Writes the anonymized frames, optionally from a background thread so that encoding overlaps with processing.
+
+    Errors are collected instead of raised, as "<path>: <message>" lines; flush() waits for the pending writes and
+    returns the errors gathered since the previous call.
+    """
+
+    def __init__(self, image_format='png', png_compression=None, link='copy', threaded=False, queue_size=8):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Invalid output format. Choose one of {', '.join(IMAGE_FORMATS)}.")
+        if link not in LINK_MODES:
+            raise ValueError(f"Invalid link mode. Choose one of {', '.join(LINK_MODES)}.")
+        self.image_format = image_format
+        self.link = link
+        if image_format == 'png':
+            self.params = [] if png_compression is None else [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        elif image_format == 'webp':
+            self.params = [cv2.IMWRITE_WEBP_QUALITY, 101]  # Quality above 100 selects lossless WebP
+        else:
+            self.params = []
+        self.errors = []
+        self.lock = threading.Lock()
+        self.counts = {'written': 0, 'copy': 0, 'hardlink': 0, 'reflink': 0, 'bytes_written': 0}
+        self.queue = None
+        if threaded:
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def output_path(self, output_directory, timestamp):
+        return os.path.join(output_directory, f"{timestamp}.{self.image_format}")
+
+    def _encode(self, output_path, image):
+        try:
+            remove_output(output_path)
+            with stage_timing.stage('encode'):
+                if self.image_format == 'npy':
+                    np.save(output_path, image)
+                elif not cv2.imwrite(output_path, image, self.params):
+                    raise Exception(f"Error writing {output_path}")
+            size = os.path.getsize(output_path)
+            with self.lock:
+                self.counts['written'] += 1
+                self.counts['bytes_written'] += size
+        except Exception as e:
+            with self.lock:
+                self.errors.append(f"{output_path}: {e}")
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is not None:
+                self._encode(*item)
+            self.queue.task_done()
+            if item is None:
+                break
+
+    def write(self, output_path, image):
+        # image must not be modified by the caller afterwards
+        if self.queue is None:
+            self._encode(output_path, image)
+        else:
+            self.queue.put((output_path, image))
+
+    def passthrough(self, source_path, output_directory, timestamp):
+        # Frames that are not anonymized are linked or copied as they are, or transcoded to a non-PNG format
+        output_path = self.output_path(output_directory, timestamp)
+        if self.image_format != 'png':
+            image = cv2.imread(source_path, cv2.IMREAD_UNCHANGED)
+            if image is None:
+                raise Exception(f"Error reading {source_path}")
+            self.write(output_path, image)
+            return
+        with stage_timing.stage('passthrough'):
+            mode = link_file(source_path, output_path, self.link)
+        with self.lock:
+            self.counts[mode] += 1
+
+    def take_counts(self):
+        # Number of frames written, copied, hard-linked and reflinked, and bytes written, since the previous call
+        with self.lock:
+            counts, self.counts = self.counts, dict.fromkeys(self.counts, 0)
+        return counts
+
+    def flush(self):
+        if self.queue is not None:
+            self.queue.join()
+        with self.lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+    def close(self):
+        errors = self.flush()
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = None
+        return errors
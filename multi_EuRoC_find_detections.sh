@@ -80,20 +80,12 @@ main() {
     done
     
     # Main script logic here
-    for dir in "$SEQUENCES_DIR"/*; do
-        if [ -d "$dir" ]; then
-            images_dir=$dir/mav0/cam0/data # Change this line as needed
-            basename_dir=$(basename "$dir")
-            parent_dir=$(dirname "$dir")
-            detections_dir=$OUTPUT_DETECTIONS_DIR/new/"$(basename "$parent_dir")"/"$basename_dir"
-            echo "Running $METHOD detection on $basename_dir"
-            if [ "$SILENT" = false ]; then
-              find_detections_EuRoC.sh "$images_dir" "$detections_dir" "$METHOD"
-            else
-              find_detections_EuRoC.sh "$images_dir" "$detections_dir" "$METHOD" --silent
-            fi
-        fi
-    done
+    # All sequences go through one Python process so that the YOLO weights are loaded only once
+    if [ "$SILENT" = false ]; then
+      python3 multi_find_detections_JSON.py "$SEQUENCES_DIR" "$OUTPUT_DETECTIONS_DIR" "$METHOD" --layout euroc
+    else
+      python3 multi_find_detections_JSON.py "$SEQUENCES_DIR" "$OUTPUT_DETECTIONS_DIR" "$METHOD" --layout euroc --silent
+    fi
 }
 # ==============================================================
 
@@ -0,0 +1,182 @@
+import argparse
+import multiprocessing
+import os
+import time
+
+import cv2
+
+from find_detections_JSON import (DECODERS, DetectionCache, DetectionResults, detection_fingerprint, load_yolo,
+                                  run_cached_detections, run_detections)
+from image_files import sorted_files
+import stage_timing
+
+# Where the images of a sequence live, relative to the sequence directory
+LAYOUTS = {
+    'euroc': os.path.join('mav0', 'cam0', 'data'),
+    'advio': os.path.join('iphone', 'mav0', 'cam0', 'data'),
+}
+
+
+def find_sequences(sequences_directory, images_subdirectory, output_detections_directory):
+    # Mirrors the output tree of multi_*_find_detections.sh: <output>/new/<sequences dir name>/<sequence>
+    sequences_directory = os.path.normpath(sequences_directory)
+    output_root = os.path.join(output_detections_directory, 'new', os.path.basename(sequences_directory))
+    sequences = []
+    with os.scandir(sequences_directory) as entries:
+        sequence_directories = sorted(entry.path for entry in entries if entry.is_dir())
+    for sequence_directory in sequence_directories:
+        sequence_name = os.path.basename(sequence_directory)
+        images_directory = os.path.join(sequence_directory, images_subdirectory)
+        if not os.path.isdir(images_directory):
+            # Notes, calibration or other directories next to the sequences
+            print(f"Skipping {sequence_name}: no {images_subdirectory} directory")
+            continue
+        sequences.append((sequence_name, images_directory, os.path.join(output_root, sequence_name)))
+    return sequences
+
+
+def detect_sequence(sequence, yolo_net, output_layers_names, method, options, show_progress=True):
+    sequence_name, images_directory, detections_directory = sequence
+    os.makedirs(detections_directory, exist_ok=True)
+
+    image_paths = sorted_files(images_directory)
+    cache = None
+    if options['resume']:
+        cache = DetectionCache(os.path.join(detections_directory, 'detections.cache.jsonl'), options['fingerprint'],
+                               options['cache_key'], options['checkpoint_every'])
+    results = DetectionResults(max(len(image_paths), 1), options['nms_iou'], options['score_threshold'],
+                               options['silent'], show_progress, cache=cache)
+    timings = {'forward': 0.0, 'decode': 0.0}
+
+    start_time = time.time()
+    _, cached_images = run_cached_detections(
+        image_paths, options['batch_size'], results,
+        lambda batches: run_detections(batches, results, yolo_net, output_layers_names, method,
+                                       decoder=DECODERS[options['decoder']], timings=timings,
+                                       pipeline=options['pipeline'], num_readers=options['readers'],
+                                       prefetch=options['prefetch']))
+    elapsed = time.time() - start_time
+
+    results.save(os.path.join(detections_directory, 'detections.' + options['format']))
+    return {'sequence': sequence_name, 'images': results.images_processed, 'detections': results.total_detections,
+            'errors': len(results.errors), 'cached': cached_images, 'elapsed': elapsed,
+            'forward': timings['forward'], 'decode': timings['decode']}
+
+
+def detect_sequence_or_failure(sequence, yolo_net, output_layers_names, method, options, show_progress=True):
+    # A sequence that fails is reported as {'sequence': name, 'failure': message} so the others still run
+    try:
+        return detect_sequence(sequence, yolo_net, output_layers_names, method, options, show_progress)
+    except Exception as e:
+        return {'sequence': sequence[0], 'failure': f"{type(e).__name__}: {e}"}
+
+
+def print_summary(summary):
+    if 'failure' in summary:
+        print(f"Failed {summary['sequence']}: {summary['failure']}")
+    else:
+        print(f"Finished {summary['sequence']}: {summary['images']} images, {summary['detections']} detections,"
+              f" {summary['errors']} errors, {summary['cached']} from cache in {summary['elapsed']:.2f} seconds")
+
+
+# Per-process state of the --workers pool, filled once by init_sequence_worker
+_worker_state = {}
+
+
+def init_sequence_worker(model_path, config_path, method, num_threads, timing=False):
+    cv2.setNumThreads(num_threads)
+    if timing:
+        stage_timing.enable()
+    yolo_net, output_layers_names = load_yolo(model_path, config_path)
+    _worker_state.update(yolo_net=yolo_net, output_layers_names=output_layers_names, method=method)
+
+
+def run_sequence_worker(task):
+    sequence, options = task
+    summary = detect_sequence_or_failure(sequence, _worker_state['yolo_net'], _worker_state['output_layers_names'],
+                                         _worker_state['method'], options, show_progress=False)
+    return summary, stage_timing.take_samples()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect human bodies in every sequence of a dataset, loading YOLOv4 once")
+    parser.add_argument("sequences_directory", type=str, help="Directory containing the sequence directories")
+    parser.add_argument("output_detections_directory", type=str, help="Directory to save the per-sequence detections to")
+    parser.add_argument("method", type=str, help="Method to use for detection (2d or 3d)", default="2d")
+    parser.add_argument("--layout", type=str, choices=list(LAYOUTS), help="Dataset layout of each sequence", default="euroc")
+    parser.add_argument("--images_subdir", type=str, help="Image directory inside each sequence, overrides --layout", default=None)
+    parser.add_argument("--model_file", type=str, help="Path to the YOLOv4 model weights file", default="parameters/yolov4.weights")
+    parser.add_argument("--config_file", type=str, help="Path to the YOLOv4 model configuration file", default="parameters/yolov4.cfg")
+    parser.add_argument("--batch-size", type=int, help="Number of images stacked into one forward pass", default=1)
+    parser.add_argument("--decoder", type=str, choices=list(DECODERS), help="YOLO output decoder", default="numpy")
+    parser.add_argument("--nms-iou", type=float, help="Enable non-maximum suppression with this IoU threshold", default=None)
+    parser.add_argument("--score-threshold", type=float, help="Minimum confidence kept by non-maximum suppression", default=0.7)
+    parser.add_argument("--pipeline", help="Overlap image reading, inference and decoding in separate stages", action="store_true")
+    parser.add_argument("--readers", type=int, help="Number of image reader threads in --pipeline mode", default=2)
+    parser.add_argument("--prefetch", type=int, help="Maximum number of prepared batches queued in --pipeline mode", default=4)
+    parser.add_argument("--workers", type=int, help="Number of worker processes, each loading the model once and taking whole sequences", default=1)
+    parser.add_argument("--resume", help="Cache per-image detections in each sequence's output directory and skip images already done", action="store_true")
+    parser.add_argument("--cache-key", type=str, choices=['stat', 'hash'], help="Identify cached images by size and mtime or by content hash", default="stat")
+    parser.add_argument("--checkpoint-every", type=int, help="Flush the detection cache to disk every N images in --resume mode", default=100)
+    parser.add_argument("--format", type=str, choices=['json', 'jsonl', 'npd'], help="Format of the per-sequence detections file", default="json")
+    parser.add_argument("--silent", help="Suppress output", action="store_true")
+    stage_timing.add_timing_arguments(parser)
+
+    args = parser.parse_args()
+    if args.batch_size < 1 or args.workers < 1 or args.readers < 1 or args.prefetch < 1:
+        parser.error("--batch-size, --workers, --readers and --prefetch must be at least 1")
+
+    METHOD = args.method
+    images_subdirectory = args.images_subdir if args.images_subdir is not None else LAYOUTS[args.layout]
+    sequences = find_sequences(args.sequences_directory, images_subdirectory, args.output_detections_directory)
+    options = {'batch_size': args.batch_size, 'decoder': args.decoder, 'nms_iou': args.nms_iou,
+               'score_threshold': args.score_threshold, 'pipeline': args.pipeline, 'readers': args.readers,
+               'prefetch': args.prefetch, 'silent': args.silent, 'resume': args.resume, 'cache_key': args.cache_key,
+               'checkpoint_every': args.checkpoint_every, 'format': args.format,
+               'fingerprint': detection_fingerprint(args.model_file, args.config_file, METHOD) if args.resume else None}
+
+    print(f"Found {len(sequences)} sequences in {args.sequences_directory}")
+    stage_timing.setup(args)
+
+    # Start timer
+    start_time = time.time()
+
+    summaries = []
+    with stage_timing.profiled(args.profile):
+        if args.workers > 1:
+            with multiprocessing.Pool(args.workers, initializer=init_sequence_worker,
+                                      initargs=(args.model_file, args.config_file, METHOD,
+                                                max(1, os.cpu_count() // args.workers),
+                                                stage_timing.is_enabled())) as pool:
+                for summary, samples in pool.imap(run_sequence_worker, [(sequence, options) for sequence in sequences]):
+                    stage_timing.merge_samples(samples)
+                    print_summary(summary)
+                    summaries.append(summary)
+        else:
+            yolo_net, output_layers_names = load_yolo(args.model_file, args.config_file)
+            for sequence in sequences:
+                print(f"Running {METHOD} detection on {sequence[0]}")
+                summary = detect_sequence_or_failure(sequence, yolo_net, output_layers_names, METHOD, options)
+                print()
+                print_summary(summary)
+                summaries.append(summary)
+
+    # Stop timer
+    end_time = time.time()
+
+    # Print detailed statistics
+    failures = [summary for summary in summaries if 'failure' in summary]
+    summaries = [summary for summary in summaries if 'failure' not in summary]
+    total_images = sum(summary['images'] for summary in summaries)
+    print(f"Total sequences processed: {len(summaries)}")
+    print(f"Failed sequences: {len(failures)}")
+    for failure in failures:
+        print(f"  {failure['sequence']}: {failure['failure']}")
+    print(f"Total images processed: {total_images}")
+    print(f"Total detections made: {sum(summary['detections'] for summary in summaries)}")
+    print(f"Error processing images: {sum(summary['errors'] for summary in summaries)}")
+    print(f"Time taken: {end_time - start_time:.2f} seconds")
+    print(f"Throughput ({args.workers} worker(s)): {total_images / (end_time - start_time):.2f} images/sec")
+    stage_timing.finish(args, total_images)
+
+    print("All sequences have been processed and detection results are saved.")
@@ -1,10 +1,103 @@
+from __future__ import annotations
+
 import argparse
+import heapq
 import json
-from nnmavmath import geometry
-import matplotlib.pyplot as plt
+import multiprocessing
+import time
+import numpy as np
+
+from detections_io import count_detections, iter_detections, write_detections
+from image_files import Progress
+import stage_timing
+
+# nnmavmath is only imported by the quadrilateral engine, through load_geometry(), so that the numpy engine runs
+# without it
+geometry = None
+
+
+def load_geometry():
+    global geometry
+    if geometry is None:
+        from nnmavmath import geometry as nnmavmath_geometry
+        nnmavmath_geometry.GeometryConfig.set_origin('topleft')
+        geometry = nnmavmath_geometry
+    return geometry
+
+
+def rectangle_bounds(rect: geometry.Quadrilateral) -> tuple:
+    # (x0, y0, x1, y1) of an axis-aligned rectangle; A is its top-left corner with the 'topleft' origin
+    return rect.A.x, rect.A.y, rect.A.x + rect.width, rect.A.y + rect.height
+
+
+def overlap_components(bounds: list[tuple], overlaps) -> list[list[int]]:
+    """
+    Connected components of the overlap relation between axis-aligned boxes.
+
+    A sweep over the x-intervals in order of their left edge keeps the boxes whose x-interval is still open in a heap
+    keyed by the right edge, so only pairs overlapping in x are compared; pairs that also overlap in y are checked with
+    overlaps(i, j) and joined with union-find. O(n log n + k) for k pairs overlapping in x.
+
+    Args:
+        bounds (list): (x0, y0, x1, y1) per box
+        overlaps (callable): overlaps(i, j) decides whether boxes i and j, whose closed bounds intersect, overlap
+
+    Returns:
+        list: Lists of box indices, in the order of their smallest index, each in increasing order
+    """
+    parent = list(range(len(bounds)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    active = []
+    for i in sorted(range(len(bounds)), key=lambda i: bounds[i][0]):
+        x0, y0, x1, y1 = bounds[i]
+        # Closed intervals, so that boxes touching at an edge still reach overlaps()
+        while active and active[0][0] < x0:
+            heapq.heappop(active)
+        for _, j in active:
+            if bounds[j][1] <= y1 and y0 <= bounds[j][3]:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j and overlaps(i, j):
+                    # The smaller index becomes the root, so that components keep the order of their first box
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+        heapq.heappush(active, (x1, i))
+
+    components = {}
+    for i in range(len(bounds)):
+        components.setdefault(find(i), []).append(i)
+    return list(components.values())
+
+
+def group_overlapping_detections(rectangles: list[geometry.Quadrilateral]) -> list[list[geometry.Quadrilateral]]:
+    """
+    Groups the rectangles into the connected components of Quadrilateral.overlaps, see overlap_components. Replaces
+    the repeated full rescans of group_overlapping_detections_pairwise.
+
+    The groups are not always the same as those of group_overlapping_detections_pairwise: that function can split
+    one connected component over several groups, when a rectangle only overlaps a member added to a group during the
+    same pass. Each of its groups lies inside one of the groups returned here, which are never split, so rectangles of
+    different groups never overlap.
+
+    Args:
+        rectangles (list): A list of geometry.Quadrilateral, left unchanged
+
+    Returns:
+        list: Groups in the order of their first rectangle in the input, each in input order
+    """
+    bounds = [rectangle_bounds(rect) for rect in rectangles]
+    components = overlap_components(bounds, lambda i, j: rectangles[i].overlaps(rectangles[j]))
+    return [[rectangles[i] for i in component] for component in components]
 
 
-def group_overlapping_detections(rectangles: geometry.Quadrilateral) -> list[geometry.Quadrilateral]:
+def group_overlapping_detections_pairwise(rectangles: geometry.Quadrilateral) -> list[geometry.Quadrilateral]:
+    # Previous grouping, kept as the reference for benchmark_rectangles.py. Rescans every remaining rectangle against
+    # every group member on each pass, and a rectangle that only reaches a group through a member added during the
+    # current pass starts a group of its own. Consumes the list it is given.
     overlapping_rectangles = [[rectangles.pop(0)]]
     while len(rectangles) > 0:
         for i in range(len(overlapping_rectangles)):
@@ -23,6 +116,57 @@ def group_overlapping_detections(rectangles: geometry.Quadrilateral) -> list[geo
 
 
 def clean_up_rectangles(rectangles: list[geometry.Quadrilateral], verbose=False):
+    """
+    Removes the rectangles enclosed by or equal to a larger one (or, for equal areas, an earlier one), with the same
+    output as clean_up_rectangles_pairwise. Containment is non-strict, compared on the bounds with <=, so a rectangle
+    sharing edges with one enclosing it is removed too; this assumes encloses_quad does the same.
+
+    Exact duplicates are dropped by hashing their bounds. The x-starts of the rest are sorted, so the rectangles that
+    can enclose a given one are a prefix of that order, checked in one vectorized comparison of the other three edges;
+    enclosed rectangles are marked in a bitmap. The prefix can hold every rectangle, so this is still O(n^2)
+    comparisons in the worst case, like the pairwise clean-up, but as one NumPy pass per rectangle instead of n
+    encloses_quad calls.
+
+    Args:
+        rectangles (list): A list of geometry.Quadrilateral
+
+    Returns:
+        list: The remaining rectangles, by decreasing area
+    """
+    start = time.perf_counter()
+    rectangles = sorted(rectangles, key=lambda rect: rect.area, reverse=True)
+
+    seen = set()
+    unique = []
+    for rect in rectangles:
+        bounds = rectangle_bounds(rect)
+        if bounds not in seen:
+            seen.add(bounds)
+            unique.append(rect)
+    deduplicated = time.perf_counter()
+
+    bounds = np.array([rectangle_bounds(rect) for rect in unique], dtype=float).reshape(-1, 4)
+    areas = np.array([rect.area for rect in unique], dtype=float)
+    order = np.argsort(bounds[:, 0], kind='stable')
+    x_starts = bounds[order, 0]
+    enclosed = np.zeros(len(unique), dtype=bool)
+    for j, (x0, y0, x1, y1) in enumerate(bounds):
+        candidates = order[:np.searchsorted(x_starts, x0, side='right')]
+        enclosing = ((bounds[candidates, 1] <= y0) & (bounds[candidates, 2] >= x1) & (bounds[candidates, 3] >= y1)
+                     & ((areas[candidates] > areas[j]) | (candidates < j)))
+        enclosed[j] = enclosing.any()
+    remaining = [rect for rect, is_enclosed in zip(unique, enclosed) if not is_enclosed]
+
+    print(f"Cleaned up rectangles: {len(rectangles)} -> {len(remaining)} "
+          f"({len(rectangles) - len(unique)} duplicates) in {1000 * (time.perf_counter() - start):.2f} ms, "
+          f"deduplication {1000 * (deduplicated - start):.2f} ms, "
+          f"containment {1000 * (time.perf_counter() - deduplicated):.2f} ms") if verbose else None
+    return remaining
+
+
+def clean_up_rectangles_pairwise(rectangles: list[geometry.Quadrilateral], verbose=False):
+    # Previous clean-up, kept as the reference for benchmark_rectangles.py: compares every pair, with list membership
+    # tests for the deleted ones
     i = 0
     to_delete = []
     rectangles = sorted(rectangles, key=lambda rect: rect.area, reverse=True)
@@ -48,6 +192,7 @@ def clean_up_rectangles(rectangles: list[geometry.Quadrilateral], verbose=False)
 
 
 def split_rectangles(rectangles: list[geometry.Quadrilateral], verbose=False):
+    load_geometry()
     vertical_sides = []
     horizontal_sides = []
     for quad in rectangles:
@@ -95,247 +240,265 @@ def non_overlapping_rects(rectangles: list[geometry.Quadrilateral], verbose=Fals
 
     # Clean up the rectangles
     print("Rectangles before first cleanup:", len(rectangles)) if verbose else None
-    rectangles = clean_up_rectangles(rectangles)
+    rectangles = clean_up_rectangles(rectangles, verbose)
     print("Rectangles after first cleanup:", len(rectangles)) if verbose else None
 
     new_rects = split_rectangles(rectangles)
 
     print(f"Final rects before cleaning up: {len(new_rects)}") if verbose else None
-    new_rects = clean_up_rectangles(new_rects)
+    new_rects = clean_up_rectangles(new_rects, verbose)
     print(f"Final rects after cleaning up: {len(new_rects)}") if verbose else None
     print("New Rects Length: ", len(new_rects)) if verbose else None
 
     return new_rects
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Takes a json file with 'timestamp':[rectangle bounding boxes] and returns a json file with non-overlapping bounding boxes.")
-    parser.add_argument("detections_json_file", type=str, help="Path to the file with detection results in JSON format")
-    parser.add_argument("output_detections_file", type=str, help="Path to the file for saving detection results in JSON format")
-    parser.add_argument("--verbose", action="store_true", default=False, help="Print verbose output")
+def non_overlapping_detections_quadrilateral(detections_list: list, verbose=False) -> list[tuple]:
+    # Per-frame path on geometry.Quadrilateral objects: group, split along the crossing sides, clean up
+    load_geometry()
+    # Convert the bounding boxes to rectangles
+    detections = [detection[:4] for detection in detections_list]
 
-    args = parser.parse_args()
-    detections_json_file = args.detections_json_file
-    output_detections_file = args.output_detections_file
+    rectangles = [geometry.Quadrilateral.rectangle(x, y, width, height) for x, y, width, height in detections]
 
-    # Load the detections from the JSON file
-    with open(detections_json_file, 'r') as f:
-        detection_data = json.load(f)
+    # Sort Rectangles by area
+    rectangles = sorted(rectangles, key=lambda rect: rect.area, reverse=True)
 
-    geometry.GeometryConfig.set_origin('topleft')
-    new_detection_data = {}
-    prog_counter = 0
-    for timestamp, detections_list in detection_data.items():
-        prog_counter += 1
-        print(f"Progress: {prog_counter}/{len(detection_data)}", end="\r") if not args.verbose else None
-
-    #     detections_list = [
-    #     [
-    #         388.0,
-    #         419.0,
-    #         35.0,
-    #         107.0,
-    #         0.7515738010406494
-    #     ],
-    #     [
-    #         387.0,
-    #         418.0,
-    #         36.0,
-    #         108.0,
-    #         0.8143460154533386
-    #     ],
-    #     [
-    #         387.0,
-    #         418.0,
-    #         36.0,
-    #         108.0,
-    #         0.8237391710281372
-    #     ],
-    #     [
-    #         418.0,
-    #         384.0,
-    #         68.0,
-    #         227.0,
-    #         0.841672420501709
-    #     ],
-    #     [
-    #         417.0,
-    #         383.0,
-    #         70.0,
-    #         228.0,
-    #         0.9171590209007263
-    #     ],
-    #     [
-    #         353.0,
-    #         404.0,
-    #         34.0,
-    #         119.0,
-    #         0.7031125426292419
-    #     ],
-    #     [
-    #         382.0,
-    #         419.0,
-    #         40.0,
-    #         107.0,
-    #         0.8884963393211365
-    #     ],
-    #     [
-    #         416.0,
-    #         384.0,
-    #         74.0,
-    #         225.0,
-    #         0.9644925594329834
-    #     ],
-    #     [
-    #         417.0,
-    #         384.0,
-    #         74.0,
-    #         224.0,
-    #         0.9666333794593811
-    #     ],
-    #     [
-    #         418.0,
-    #         385.0,
-    #         73.0,
-    #         223.0,
-    #         0.9598330855369568
-    #     ],
-    #     [
-    #         598.0,
-    #         369.0,
-    #         106.0,
-    #         306.0,
-    #         0.9890244007110596
-    #     ],
-    #     [
-    #         599.0,
-    #         369.0,
-    #         105.0,
-    #         306.0,
-    #         0.9896005988121033
-    #     ],
-    #     [
-    #         599.0,
-    #         368.0,
-    #         105.0,
-    #         307.0,
-    #         0.9892266392707825
-    #     ],
-    #     [
-    #         196.0,
-    #         353.0,
-    #         170.0,
-    #         468.0,
-    #         0.783186674118042
-    #     ],
-    #     [
-    #         194.0,
-    #         348.0,
-    #         175.0,
-    #         480.0,
-    #         0.8403423428535461
-    #     ],
-    #     [
-    #         190.0,
-    #         368.0,
-    #         171.0,
-    #         480.0,
-    #         0.8097853660583496
-    #     ],
-    #     [
-    #         190.0,
-    #         365.0,
-    #         170.0,
-    #         484.0,
-    #         0.8070376515388489
-    #     ],
-    #     [
-    #         197.0,
-    #         362.0,
-    #         170.0,
-    #         493.0,
-    #         0.9946788549423218
-    #     ],
-    #     [
-    #         197.0,
-    #         359.0,
-    #         170.0,
-    #         497.0,
-    #         0.9954067468643188
-    #     ],
-    #     [
-    #         600.0,
-    #         374.0,
-    #         102.0,
-    #         301.0,
-    #         0.9915356040000916
-    #     ],
-    #     [
-    #         186.0,
-    #         375.0,
-    #         179.0,
-    #         477.0,
-    #         0.8241384029388428
-    #     ],
-    #     [
-    #         187.0,
-    #         373.0,
-    #         177.0,
-    #         476.0,
-    #         0.835101842880249
-    #     ],
-    #     [
-    #         194.0,
-    #         365.0,
-    #         177.0,
-    #         485.0,
-    #         0.9956250786781311
-    #     ],
-    #     [
-    #         195.0,
-    #         364.0,
-    #         176.0,
-    #         484.0,
-    #         0.9955061078071594
-    #     ]
-    # ]
-
-        # Convert the bounding boxes to rectangles
-        detections = [detection[:4] for detection in detections_list]
-
-        rectangles = [geometry.Quadrilateral.rectangle(x, y, width, height) for x, y, width, height in detections]
-
-        # Sort Rectangles by area
-        rectangles = sorted(rectangles, key=lambda rect: rect.area, reverse=True)
-
-        # Group overlapping rectangles
+    # Group overlapping rectangles
+    with stage_timing.stage('group'):
         grouped_overlapping_rectangles = group_overlapping_detections(rectangles)
 
-        print(f"Overlapping rectangles: {len(grouped_overlapping_rectangles)}") if args.verbose else None
+    print(f"Overlapping rectangles: {len(grouped_overlapping_rectangles)}") if verbose else None
 
-        new_rectangles = []
-        i=0
-        for overlapping_rectangles in grouped_overlapping_rectangles:
-            i+=1
-            print(f"====== Group number: {i} =======") if args.verbose else None
-            new_rectangles.extend(non_overlapping_rects(overlapping_rectangles, args.verbose))
-            print(f"================================\n\n") if args.verbose else None
+    new_rectangles = []
+    i=0
+    for overlapping_rectangles in grouped_overlapping_rectangles:
+        i+=1
+        print(f"====== Group number: {i} =======") if verbose else None
+        with stage_timing.stage('non_overlapping'):
+            new_rectangles.extend(non_overlapping_rects(overlapping_rectangles, verbose))
+        print(f"================================\n\n") if verbose else None
 
-        print(f"Final Rectangles: {len(new_rectangles)}") if args.verbose else None
+    print(f"Final Rectangles: {len(new_rectangles)}") if verbose else None
 
-        # Convert the rectangles back to bounding boxes
-        new_detections = [(rect.A.x, rect.A.y, rect.width, rect.height) for rect in new_rectangles]
+    # Convert the rectangles back to bounding boxes
+    return [(rect.A.x, rect.A.y, rect.width, rect.height) for rect in new_rectangles]
 
-        # Save the non-overlapping detections to the output JSON file
-        new_detection_data[timestamp] = new_detections
 
-        # Free up memory
-        del rectangles
-        del new_rectangles
-        del grouped_overlapping_rectangles
-        del detections
+def coverage_grid(bounds: np.ndarray) -> tuple:
+    # Coordinate compression: the unique x and y edges form a grid and the boxes are painted into it with a 2d
+    # difference array. Returns (xs, ys, covered), covered[r, c] for the cell from xs[c], ys[r] to xs[c + 1], ys[r + 1]
+    xs = np.unique(bounds[:, [0, 2]])
+    ys = np.unique(bounds[:, [1, 3]])
+    columns = np.searchsorted(xs, bounds[:, [0, 2]])
+    rows = np.searchsorted(ys, bounds[:, [1, 3]])
+
+    coverage = np.zeros((len(ys), len(xs)), dtype=np.int32)
+    np.add.at(coverage, (rows[:, 0], columns[:, 0]), 1)
+    np.add.at(coverage, (rows[:, 0], columns[:, 1]), -1)
+    np.add.at(coverage, (rows[:, 1], columns[:, 0]), -1)
+    np.add.at(coverage, (rows[:, 1], columns[:, 1]), 1)
+    covered = coverage.cumsum(axis=0).cumsum(axis=1)[:-1, :-1] > 0
+    return xs, ys, covered
+
 
+def covered_cells(bounds: np.ndarray) -> np.ndarray:
+    """
+    Splits the union of axis-aligned boxes into the disjoint cells of their compressed grid, see coverage_grid.
+
+    Args:
+        bounds (np.ndarray): (N, 4) array of x0, y0, x1, y1
+
+    Returns:
+        np.ndarray: (M, 4) array of x, y, width, height of the covered cells, row by row
+    """
+    xs, ys, covered = coverage_grid(bounds)
+    cell_rows, cell_columns = np.nonzero(covered)
+    return np.stack([xs[cell_columns], ys[cell_rows], xs[cell_columns + 1] - xs[cell_columns],
+                     ys[cell_rows + 1] - ys[cell_rows]], axis=1)
+
+
+def covered_strips(bounds: np.ndarray) -> np.ndarray:
+    """
+    Splits the union of axis-aligned boxes into few disjoint boxes: the covered cells of each row of the compressed
+    grid are merged into maximal horizontal runs, and runs spanning the same columns in consecutive rows into one box.
+    Not always the minimum number of boxes, but close to it for the unions of a few boxes per person.
+
+    Args:
+        bounds (np.ndarray): (N, 4) array of x0, y0, x1, y1
+
+    Returns:
+        np.ndarray: (M, 4) array of x, y, width, height, by top edge and then left edge
+    """
+    xs, ys, covered = coverage_grid(bounds)
+    # A run starts where a covered cell follows an uncovered one and ends (exclusively) at the next uncovered one
+    change = np.diff(np.pad(covered, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(change == 1)
+    ends = np.nonzero(change == -1)[1]
+
+    order = np.lexsort((rows, ends, starts))
+    rows, starts, ends = rows[order], starts[order], ends[order]
+    new_box = np.ones(len(rows), dtype=bool)
+    new_box[1:] = (starts[1:] != starts[:-1]) | (ends[1:] != ends[:-1]) | (rows[1:] != rows[:-1] + 1)
+    first = np.flatnonzero(new_box)
+    last = np.append(first[1:], len(rows)) - 1
+
+    boxes = np.stack([xs[starts[first]], ys[rows[first]], xs[ends[first]] - xs[starts[first]],
+                      ys[rows[last] + 1] - ys[rows[first]]], axis=1)
+    return boxes[np.lexsort((boxes[:, 0], boxes[:, 1]))]
+
+
+def merge_boxes(boxes: list) -> list[tuple]:
+    # Minimal-cover output mode: the (x, y, width, height) boxes of a frame as maximal strips with the same union
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    if len(boxes) == 0:
+        return []
+    bounds = np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1)
+    return covered_strips(bounds).tolist()
+
+
+def non_overlapping_detections_numpy(detections_list: list, verbose=False) -> list[tuple]:
+    """
+    Takes the detections of a frame and returns non-overlapping boxes covering the same region, computed on an (N, 4)
+    array instead of geometry.Quadrilateral objects. Boxes are grouped like in group_overlapping_detections and each
+    group is split into the cells of its own compressed grid, so the edges of one group do not cut another.
+
+    Args:
+        detections_list (list): [x, y, width, height, ...] per detection
+
+    Returns:
+        list: (x, y, width, height) per non-overlapping box, in the dtype of the detections
+    """
+    boxes = np.asarray([detection[:4] for detection in detections_list]).reshape(-1, 4)
+    boxes = boxes[(boxes[:, 2] > 0) & (boxes[:, 3] > 0)]
+    bounds = np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1)
+
+    with stage_timing.stage('group'):
+        edges = bounds.tolist()
+        components = overlap_components(edges, lambda i, j: edges[i][0] < edges[j][2] and edges[j][0] < edges[i][2]
+                                        and edges[i][1] < edges[j][3] and edges[j][1] < edges[i][3])
+
+    with stage_timing.stage('non_overlapping'):
+        cells = [covered_cells(bounds[component]) for component in components]
+
+    print(f"Overlapping groups: {len(components)}, boxes: {len(boxes)} -> {sum(map(len, cells))}") if verbose else None
+    return np.concatenate(cells).tolist() if cells else []
 
-    with open(output_detections_file, 'w') as f:
-        json.dump(new_detection_data, f)
+
+ENGINES = {'numpy': non_overlapping_detections_numpy, 'quadrilateral': non_overlapping_detections_quadrilateral}
+
+
+def process_frame(detections_list: list, engine='numpy', cover=False, verbose=False) -> tuple:
+    # Returns (boxes, number of non-overlapping boxes before merging, seconds taken)
+    start = time.perf_counter()
+    new_detections = ENGINES[engine](detections_list, verbose)
+    non_overlapping = len(new_detections)
+    if cover:
+        with stage_timing.stage('cover'):
+            new_detections = merge_boxes(new_detections)
+        print(f"Boxes after merging: {len(new_detections)}") if verbose else None
+    return new_detections, non_overlapping, time.perf_counter() - start
+
+
+# Per-process state of the --workers pool, filled once by init_geometry_worker
+_worker_state = {}
+
+
+def init_geometry_worker(engine, cover, timing=False):
+    if timing:
+        stage_timing.enable()
+    _worker_state.update(engine=engine, cover=cover)
+
+
+def run_geometry_worker(chunk):
+    # chunk is a list of (frame index, detections); the index lets the parent put the frames back in order
+    results = [(index, *process_frame(detections_list, _worker_state['engine'], _worker_state['cover']))
+               for index, detections_list in chunk]
+    return results, stage_timing.take_samples()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Takes a json file with 'timestamp':[rectangle bounding boxes] and returns a json file with non-overlapping bounding boxes.")
+    parser.add_argument("detections_json_file", type=str, help="Path to the file with detection results in JSON, JSON Lines (.jsonl) or NumPy (.npd) format")
+    parser.add_argument("output_detections_file", type=str, help="Path to the file for saving detection results in JSON, JSON Lines (.jsonl) or NumPy (.npd) format")
+    parser.add_argument("--verbose", action="store_true", default=False, help="Print verbose output")
+    parser.add_argument("--engine", type=str, choices=list(ENGINES), default="numpy",
+                        help="numpy: coordinate compression on box arrays, quadrilateral: the previous path, needs nnmavmath")
+    parser.add_argument("--cover", action="store_true", default=False,
+                        help="Merge the non-overlapping boxes of each frame into maximal strips, fewer boxes with the same union")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes, taking the frames with the most detections first (no verbose output from workers)")
+    parser.add_argument("--slowest", type=int, default=5, help="Number of slowest frames to list at the end")
+    parser.add_argument("--frame-times", type=str, default=None, metavar="PATH",
+                        help="Write the detection count and processing time of every frame to a JSON file")
+    stage_timing.add_timing_arguments(parser)
+
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    stage_timing.setup(args)
+    detections_json_file = args.detections_json_file
+    output_detections_file = args.output_detections_file
+
+    # Stream the detections from the JSON, JSON Lines or .npd file
+    total_timestamps = count_detections(detections_json_file)
+
+    new_detection_data = {}
+    box_counts = {'detections': 0, 'non_overlapping': 0, 'cover': 0}
+    # (timestamp, detections, boxes, non-overlapping boxes, seconds) per frame, in input order
+    frame_results = []
+    progress = Progress(total_timestamps, enabled=not args.verbose)
+    with stage_timing.profiled(args.profile):
+        if args.workers > 1:
+            frames = list(iter_detections(detections_json_file))
+            # Longest job first: chunks of the frames with the most detections are handed out first, so that no slow
+            # frame is left for the end while the other workers idle
+            order = sorted(range(len(frames)), key=lambda i: len(frames[i][1]), reverse=True)
+            chunk_size = max(1, min(16, len(frames) // (4 * args.workers)))
+            chunks = [[(i, frames[i][1]) for i in order[start:start + chunk_size]]
+                      for start in range(0, len(order), chunk_size)]
+            results = [None] * len(frames)
+            with multiprocessing.Pool(args.workers, initializer=init_geometry_worker,
+                                      initargs=(args.engine, args.cover, stage_timing.is_enabled())) as pool:
+                for chunk_results, samples in pool.imap_unordered(run_geometry_worker, chunks):
+                    stage_timing.merge_samples(samples)
+                    for index, *result in chunk_results:
+                        results[index] = result
+                    progress.update(len(chunk_results))
+            frame_results = [(timestamp, len(detections_list), *result)
+                             for (timestamp, detections_list), result in zip(frames, results)]
+            del frames, results
+        else:
+            for timestamp, detections_list in iter_detections(detections_json_file):
+                progress.update()
+                frame_results.append((timestamp, len(detections_list),
+                                      *process_frame(detections_list, args.engine, args.cover, args.verbose)))
+    progress.finish()
+
+    frame_times = {}
+    for timestamp, detections, new_detections, non_overlapping, seconds in frame_results:
+        # Save the non-overlapping detections to the output JSON file
+        new_detection_data[timestamp] = new_detections
+        box_counts['detections'] += detections
+        box_counts['non_overlapping'] += non_overlapping
+        box_counts['cover'] += len(new_detections)
+        frame_times[timestamp] = {'detections': detections, 'seconds': seconds}
+        stage_timing.record('frame', seconds)
+    del frame_results
+
+    with stage_timing.stage('write_detections'):
+        write_detections(new_detection_data, output_detections_file, indent=None)
+    print(f"\nBoxes: {box_counts['detections']} detections, {box_counts['non_overlapping']} non-overlapping")
+    if args.cover and box_counts['non_overlapping']:
+        print(f"Boxes after merging into strips: {box_counts['cover']} "
+              f"({100 * (1 - box_counts['cover'] / box_counts['non_overlapping']):.1f}% fewer)")
+    if args.slowest > 0 and frame_times:
+        print(f"Slowest frames ({args.workers} worker(s)):")
+        for timestamp, frame in sorted(frame_times.items(), key=lambda item: item[1]['seconds'], reverse=True)[:args.slowest]:
+            print(f"  {timestamp}: {frame['detections']} detections, {1000 * frame['seconds']:.2f} ms")
+    if args.frame_times:
+        with open(args.frame_times, 'w') as f:
+            json.dump(frame_times, f, indent=4)
+        print(f"Frame times saved to {args.frame_times}")
     print(f"Saved non-overlapping detections to {output_detections_file}")
+    stage_timing.finish(args, total_timestamps)
@@ -0,0 +1,46 @@
+import numpy as np
+
+# Random frames and reference checks for the rectangle code of non_overlapping_detections.py, shared by
+# benchmark_rectangles.py and the tests. Nothing here needs nnmavmath: rectangles only have to provide overlaps().
+
+
+def random_frame(rng, boxes, width, height, min_size=(20, 60), max_size=(180, 480), jitter=6, boxes_per_person=5):
+    # Integer YOLO-like detections: a few people, each found several times with slightly jittered boxes
+    people = max(1, boxes // boxes_per_person)
+    sizes = rng.integers(min_size, max_size, (people, 2))
+    corners = rng.integers(0, [width, height], (people, 2)) - sizes // 2
+    person = rng.integers(0, people, boxes)
+    detections = np.concatenate([corners[person], sizes[person]], axis=1) + rng.integers(-jitter, jitter + 1, (boxes, 4))
+    detections[:, 2:] = np.maximum(detections[:, 2:], 1)
+    return [box + [0.9] for box in detections.tolist()]
+
+
+def partition(groups, rectangles):
+    # Groups as a set of frozensets of input positions, independent of group and member order
+    index = {id(rect): i for i, rect in enumerate(rectangles)}
+    return {frozenset(index[id(rect)] for rect in group) for group in groups}
+
+
+def connected_components(rectangles):
+    # Reference grouping: every pair compared, components by flood fill
+    unvisited = set(range(len(rectangles)))
+    components = set()
+    while unvisited:
+        stack = [unvisited.pop()]
+        component = set(stack)
+        while stack:
+            i = stack.pop()
+            neighbours = {j for j in unvisited if rectangles[i].overlaps(rectangles[j])}
+            unvisited -= neighbours
+            component |= neighbours
+            stack.extend(neighbours)
+        components.add(frozenset(component))
+    return components
+
+
+def coverage(boxes, shape=(300, 300), offset=100):
+    # Number of boxes covering each pixel, for integer boxes shifted by offset so that negative corners fit
+    counts = np.zeros(shape, dtype=np.int32)
+    for x, y, width, height in boxes:
+        counts[int(y) + offset:int(y + height) + offset, int(x) + offset:int(x + width) + offset] += 1
+    return counts
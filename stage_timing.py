@@ -0,0 +1,141 @@
+import contextlib
+import cProfile
+import json
+import pstats
+import threading
+import time
+
+import numpy as np
+
+# Opt-in per-stage timing shared by the entry points. Instrumented code wraps a stage in `with stage('name'):` or
+# reports a duration it measured itself with record(); both do nothing until enable() is called, so the scripts pay
+# nothing for it by default. Worker processes send their samples back with take_samples() and the parent adds them
+# with merge_samples().
+
+_samples = {}
+_lock = threading.Lock()
+_enabled = False
+_start = None
+
+
+def enable():
+    global _enabled, _start
+    _enabled = True
+    _start = time.perf_counter()
+
+
+def is_enabled():
+    return _enabled
+
+
+def record(name, seconds):
+    if _enabled:
+        with _lock:
+            _samples.setdefault(name, []).append(seconds)
+
+
+@contextlib.contextmanager
+def _timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def stage(name):
+    return _timed(name) if _enabled else contextlib.nullcontext()
+
+
+def take_samples():
+    # Hands over and clears the samples recorded so far, e.g. at the end of a worker task
+    global _samples
+    with _lock:
+        samples, _samples = _samples, {}
+    return samples
+
+
+def merge_samples(samples):
+    if _enabled:
+        with _lock:
+            for name, durations in samples.items():
+                _samples.setdefault(name, []).extend(durations)
+
+
+def summary(items=None):
+    """
+    Per-stage statistics of the samples recorded so far.
+
+    Args:
+        items (int): Number of frames (or other units) processed, for the overall throughput
+
+    Returns:
+        dict: wall_time, items, items_per_second and, per stage, count, total, mean, p50, p95, p99 and max in
+        seconds and calls_per_second, the rate the stage alone would sustain
+    """
+    wall_time = time.perf_counter() - _start if _start is not None else 0.0
+    report = {'wall_time': wall_time, 'items': items,
+              'items_per_second': items / wall_time if items and wall_time > 0 else None, 'stages': {}}
+    with _lock:
+        samples = {name: np.asarray(durations) for name, durations in _samples.items()}
+    for name, durations in samples.items():
+        p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+        total = float(durations.sum())
+        report['stages'][name] = {
+            'count': int(durations.size), 'total': total, 'mean': total / durations.size,
+            'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(durations.max()),
+            'calls_per_second': durations.size / total if total > 0 else None,
+        }
+    return report
+
+
+def print_summary(report):
+    print(f"\n{'Stage':32s} {'count':>8s} {'total s':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'calls/s':>9s}")
+    for name, stats in sorted(report['stages'].items(), key=lambda item: -item[1]['total']):
+        rate = f"{stats['calls_per_second']:9.1f}" if stats['calls_per_second'] else f"{'-':>9s}"
+        print(f"{name:32s} {stats['count']:8d} {stats['total']:9.2f} {1000 * stats['p50']:9.2f} "
+              f"{1000 * stats['p95']:9.2f} {1000 * stats['p99']:9.2f} {rate}")
+    if report['items_per_second']:
+        print(f"Throughput: {report['items_per_second']:.2f} items/sec over {report['wall_time']:.2f} seconds")
+
+
+def add_timing_arguments(parser):
+    parser.add_argument("--timings", action="store_true", help="Print per-stage timing percentiles at the end")
+    parser.add_argument("--timings-json", type=str, default=None, metavar="PATH",
+                        help="Write the per-stage timings to a JSON report (implies --timings)")
+    parser.add_argument("--profile", type=str, default=None, metavar="PATH",
+                        help="Run under cProfile, save the stats to PATH and print the top functions")
+
+
+def setup(args):
+    # Turns timing on when the parsed arguments ask for it
+    if args.timings or args.timings_json:
+        enable()
+
+
+def finish(args, items=None):
+    if not (args.timings or args.timings_json):
+        return
+    report = summary(items)
+    print_summary(report)
+    if args.timings_json:
+        with open(args.timings_json, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Timings saved to {args.timings_json}")
+
+
+@contextlib.contextmanager
+def profiled(path, top=25):
+    # cProfile of the main process; worker processes are not profiled
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"\nProfile saved to {path}, top {top} functions by cumulative time:")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(top)
@@ -0,0 +1,62 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+from anonymize_images_JSON import NoiseOperator, anonymize_images, parse_chain
+
+
+def write_frames(tmp_path, count=6):
+    image_directory = tmp_path / "images"
+    image_directory.mkdir()
+    rng = np.random.default_rng(0)
+    detections = {}
+    for i in range(count):
+        timestamp = str(1000 + i)
+        cv2.imwrite(str(image_directory / f"{timestamp}.png"), rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+        detections[timestamp] = [[4 + i, 6, 20, 30, 0.9], [30, 10, 16, 24, 0.8]] if i % 3 else []
+    detections_file = tmp_path / "detections.json"
+    detections_file.write_text(json.dumps(detections))
+    return str(image_directory), str(detections_file)
+
+
+def read_outputs(output_directory):
+    return {name: cv2.imread(os.path.join(output_directory, name), cv2.IMREAD_UNCHANGED)
+            for name in sorted(os.listdir(output_directory)) if name.endswith('.png')}
+
+
+def test_seeded_noise_is_the_same_for_any_number_of_workers(tmp_path):
+    image_directory, detections_file = write_frames(tmp_path)
+    outputs = []
+    for fast in (False, True):
+        for workers in (1, 2, 3):
+            output_directory = str(tmp_path / f"noise_{fast}_{workers}")
+            variants = [(output_directory, [NoiseOperator('laplacian', 0.5, fast=fast, seed=7)])]
+            anonymize_images(image_directory, detections_file, '3d', variants, copy_undetected=True, workers=workers,
+                             chunk_size=1 if workers == 3 else None, seed=7)
+            outputs.append(read_outputs(output_directory))
+        reference = outputs[-3]
+        assert len(reference) == 6
+        for other in outputs[-2:]:
+            assert reference.keys() == other.keys()
+            assert all(np.array_equal(reference[name], other[name]) for name in reference)
+
+
+def test_operator_seed_alone_makes_legacy_noise_reproducible(tmp_path):
+    # "noise:seed=4" of the engine CLI, which passes no global seed, on the float64 np.random path
+    image_directory, detections_file = write_frames(tmp_path)
+    outputs = []
+    for run, workers in enumerate((1, 1, 2)):
+        output_directory = str(tmp_path / f"noise_{run}")
+        np.random.seed(run)
+        anonymize_images(image_directory, detections_file, '3d', [(output_directory, parse_chain("noise:seed=4"))],
+                         copy_undetected=True, workers=workers)
+        outputs.append(read_outputs(output_directory))
+    for other in outputs[1:]:
+        assert all(np.array_equal(outputs[0][name], other[name]) for name in outputs[0])
+
+    output_directory = str(tmp_path / "noise_seed_5")
+    anonymize_images(image_directory, detections_file, '3d', [(output_directory, parse_chain("noise:seed=5"))],
+                     copy_undetected=True)
+    assert not all(np.array_equal(outputs[0][name], image) for name, image in read_outputs(output_directory).items())
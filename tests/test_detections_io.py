@@ -0,0 +1,41 @@
+import json
+
+import numpy as np
+
+from detections_io import load_detection_arrays, load_detections, write_detections
+
+
+DETECTIONS = {
+    "1403636579763555584": [[586, 222, 103, 133, 0.7408531308174133], [252, 148, 199, 137, 0.949999988079071]],
+    "1403636579813555456": [[10, 20, 30, 40]],
+    "1403636579863555584": [],
+}
+
+FLOAT_DETECTIONS = {
+    "0001": [[388.25, 419.5, 35.75, 107.0], [-3.5, 0.1, 2.2, 1e-3, 0.5]],
+    "0002": [],
+}
+
+
+def round_trip(detections, tmp_path):
+    write_detections(detections, str(tmp_path / "detections.npd"))
+    write_detections(load_detections(str(tmp_path / "detections.npd")), str(tmp_path / "detections.json"))
+    with open(tmp_path / "detections.json") as f:
+        return json.load(f)
+
+
+def test_npd_round_trip_keeps_integer_boxes(tmp_path):
+    assert round_trip(DETECTIONS, tmp_path) == DETECTIONS
+    assert load_detection_arrays(str(tmp_path / "detections.npd"))['boxes'].dtype == np.int32
+
+
+def test_npd_round_trip_keeps_float_boxes_and_confidences(tmp_path):
+    result = round_trip(FLOAT_DETECTIONS, tmp_path)
+    assert result == FLOAT_DETECTIONS
+    assert all(isinstance(value, float) for box in result["0001"] for value in box)
+    assert load_detection_arrays(str(tmp_path / "detections.npd"))['boxes'].dtype == np.float64
+
+
+def test_jsonl_round_trip(tmp_path):
+    write_detections(FLOAT_DETECTIONS, str(tmp_path / "detections.jsonl"))
+    assert load_detections(str(tmp_path / "detections.jsonl")) == FLOAT_DETECTIONS
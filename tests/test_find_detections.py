@@ -0,0 +1,97 @@
+import cv2
+import numpy as np
+import pytest
+
+from find_detections_JSON import (CONFIDENCE_THRESHOLD, decode_detections, decode_detections_loop,
+                                  decode_batch, non_max_suppression, split_batch_detections)
+
+
+def random_outputs(rng, rows=(507, 2028), classes=80):
+    # Raw YOLO region outputs: centre, size and objectness in [0, 1], then class scores, some of them above the
+    # threshold and some tied with the person score
+    outputs = []
+    for count in rows:
+        output = rng.random((count, 5 + classes), dtype=np.float32)
+        output[:, 5:] *= rng.random((count, 1), dtype=np.float32) ** 4
+        tied = rng.random(count) < 0.05
+        output[tied, 6] = output[tied, 5]
+        high = rng.random(count) < 0.1
+        output[high, 5] = rng.uniform(CONFIDENCE_THRESHOLD, 1, high.sum()).astype(np.float32)
+        outputs.append(output)
+    return outputs
+
+
+@pytest.mark.parametrize("image_shape", [(480, 752), (480, 752, 3), (1080, 1920, 3), (37, 53)])
+def test_decode_detections_matches_loop(image_shape):
+    rng = np.random.default_rng(image_shape[0])
+    for _ in range(50):
+        outputs = random_outputs(rng)
+        expected = decode_detections_loop(outputs, image_shape)
+        assert expected
+        assert decode_detections(outputs, image_shape) == expected
+
+
+def test_decode_detections_without_people():
+    outputs = [np.zeros((10, 85), dtype=np.float32)]
+    assert decode_detections(outputs, (480, 752)) == decode_detections_loop(outputs, (480, 752)) == []
+
+
+def random_bodies(rng, count):
+    # Integer boxes clustered around a few people, so that many pairs overlap, with distinct scores
+    people = rng.integers(0, [700, 400], (max(1, count // 4), 2))
+    corners = people[rng.integers(0, len(people), count)] + rng.integers(-20, 21, (count, 2))
+    sizes = rng.integers(1, [120, 240], (count, 2))
+    scores = rng.permutation(count) / count * 0.6 + 0.35 + rng.uniform(0, 0.5 / count, count)
+    return [[int(x), int(y), int(w), int(h), float(score)]
+            for (x, y), (w, h), score in zip(corners, sizes, scores)]
+
+
+def near_threshold(bodies, iou_threshold):
+    boxes = np.array([body[:4] for body in bodies], dtype=np.float64)
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    inter = (np.clip(np.minimum.outer(x2, x2) - np.maximum.outer(x1, x1), 0, None) *
+             np.clip(np.minimum.outer(y2, y2) - np.maximum.outer(y1, y1), 0, None))
+    areas = boxes[:, 2] * boxes[:, 3]
+    iou = inter / (areas[:, None] + areas[None, :] - inter)
+    return bool(np.any(np.abs(iou - iou_threshold) < 1e-6))
+
+
+@pytest.mark.parametrize("iou_threshold, score_threshold", [(0.4, 0.0), (0.4, 0.7), (0.1, 0.5), (0.8, 0.0)])
+def test_non_max_suppression_matches_opencv(iou_threshold, score_threshold):
+    rng = np.random.default_rng(int(iou_threshold * 10 + score_threshold * 100))
+    for count in rng.integers(1, 60, 200):
+        bodies = random_bodies(rng, count)
+        if near_threshold(bodies, iou_threshold):
+            # OpenCV compares the overlap in single precision, so IoUs right at the threshold may go either way
+            continue
+        indices = cv2.dnn.NMSBoxes([body[:4] for body in bodies], [body[4] for body in bodies],
+                                   score_threshold, iou_threshold)
+        expected = [bodies[i] for i in sorted(np.asarray(indices, dtype=int).reshape(-1))]
+        assert non_max_suppression(bodies, iou_threshold, score_threshold) == expected
+
+
+def test_non_max_suppression_without_bodies():
+    assert non_max_suppression([], 0.4) == []
+
+
+@pytest.mark.parametrize("flat", [False, True])
+@pytest.mark.parametrize("batch_len", [1, 2, 5])
+def test_split_batch_detections(flat, batch_len):
+    rng = np.random.default_rng(batch_len)
+    images = [random_outputs(rng) for _ in range(batch_len)]
+    # One array per output layer, either (N, rows, attrs) or (N * rows, attrs) depending on the OpenCV version
+    detections = [np.stack([outputs[layer] for outputs in images]) for layer in range(len(images[0]))]
+    if flat:
+        detections = [detection.reshape(-1, detection.shape[-1]) for detection in detections]
+
+    per_image = split_batch_detections(detections, batch_len)
+    assert len(per_image) == batch_len
+    for outputs, split in zip(images, per_image):
+        assert len(split) == len(outputs)
+        for output, layer in zip(outputs, split):
+            np.testing.assert_array_equal(layer, output)
+
+    shapes = [(480, 752), (1080, 1920, 3), (37, 53), (480, 752, 3), (600, 800)][:batch_len]
+    assert decode_batch(detections, shapes) == [decode_detections(outputs, shape)
+                                                for outputs, shape in zip(images, shapes)]
@@ -0,0 +1,49 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from image_output import ImageWriter, link_file
+
+
+@pytest.fixture
+def source(tmp_path):
+    image = np.random.default_rng(0).integers(0, 256, (32, 40, 3), dtype=np.uint8)
+    path = tmp_path / "input" / "1000.png"
+    path.parent.mkdir()
+    cv2.imwrite(str(path), image)
+    return str(path)
+
+
+@pytest.mark.parametrize("threaded", [False, True])
+def test_write_over_hard_linked_output_keeps_the_source(tmp_path, source, threaded):
+    original = open(source, 'rb').read()
+    output_directory = str(tmp_path / "output")
+    os.makedirs(output_directory)
+
+    # A first run links the frame through unchanged
+    ImageWriter(link='hardlink').passthrough(source, output_directory, "1000")
+    output_path = os.path.join(output_directory, "1000.png")
+    assert os.path.samefile(source, output_path)
+
+    # A second run anonymizes the same frame into the same directory
+    anonymized = np.zeros((32, 40, 3), dtype=np.uint8)
+    writer = ImageWriter(threaded=threaded)
+    writer.write(output_path, anonymized)
+    assert writer.close() == []
+
+    assert open(source, 'rb').read() == original
+    assert not os.path.samefile(source, output_path)
+    assert np.array_equal(cv2.imread(output_path), anonymized)
+
+
+def test_copy_over_hard_linked_output(tmp_path, source):
+    original = open(source, 'rb').read()
+    output_path = str(tmp_path / "1000.png")
+    assert link_file(source, output_path, 'hardlink') == 'hardlink'
+
+    assert link_file(source, output_path, 'copy') == 'copy'
+    assert not os.path.samefile(source, output_path)
+    assert open(output_path, 'rb').read() == original
+    assert open(source, 'rb').read() == original
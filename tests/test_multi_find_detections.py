@@ -0,0 +1,24 @@
+import os
+
+from multi_find_detections_JSON import LAYOUTS, detect_sequence_or_failure, find_sequences
+
+
+def test_find_sequences_skips_directories_without_images(tmp_path, capsys):
+    for name in ['MH_02', 'MH_01']:
+        os.makedirs(tmp_path / 'seqs' / name / LAYOUTS['euroc'])
+    os.makedirs(tmp_path / 'seqs' / 'AA_notes')
+    (tmp_path / 'seqs' / 'README').write_text('not a sequence')
+
+    sequences = find_sequences(str(tmp_path / 'seqs'), LAYOUTS['euroc'], str(tmp_path / 'out'))
+    assert sequences == [(name, str(tmp_path / 'seqs' / name / LAYOUTS['euroc']), str(tmp_path / 'out' / 'new' / 'seqs' / name))
+                         for name in ['MH_01', 'MH_02']]
+    assert "Skipping AA_notes" in capsys.readouterr().out
+
+
+def test_failed_sequence_is_reported(tmp_path):
+    # The output directory cannot be created because a file is in the way
+    (tmp_path / 'MH_01').write_text('')
+    sequence = ('MH_01', str(tmp_path / 'images'), str(tmp_path / 'MH_01'))
+    summary = detect_sequence_or_failure(sequence, None, None, '3d', {}, show_progress=False)
+    assert summary['sequence'] == 'MH_01'
+    assert summary['failure'].startswith('FileExistsError')
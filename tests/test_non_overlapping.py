@@ -0,0 +1,174 @@
+import sys
+
+import numpy as np
+import pytest
+
+import non_overlapping_detections
+from non_overlapping_detections import (clean_up_rectangles, clean_up_rectangles_pairwise, group_overlapping_detections,
+                                        group_overlapping_detections_pairwise, merge_boxes,
+                                        load_geometry, non_overlapping_detections_numpy, rectangle_bounds)
+from rectangle_checks import connected_components, coverage, partition, random_frame
+
+
+class Rect:
+    # Axis-aligned stand-in for nnmavmath's geometry.Quadrilateral, with non-strict containment
+    class Point:
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    def __init__(self, x, y, width, height):
+        self.A = Rect.Point(x, y)
+        self.width, self.height = width, height
+        self.bounds = (x, y, x + width, y + height)
+
+    @property
+    def area(self):
+        return self.width * self.height
+
+    def overlaps(self, other):
+        return (self.bounds[0] < other.bounds[2] and other.bounds[0] < self.bounds[2]
+                and self.bounds[1] < other.bounds[3] and other.bounds[1] < self.bounds[3])
+
+    def encloses_quad(self, other):
+        return (self.bounds[0] <= other.bounds[0] and self.bounds[1] <= other.bounds[1]
+                and other.bounds[2] <= self.bounds[2] and other.bounds[3] <= self.bounds[3])
+
+    def equals(self, other):
+        return self.bounds == other.bounds
+
+
+def rectangles_of(detections):
+    rectangles = [Rect(x, y, width, height) for x, y, width, height, _ in detections]
+    return sorted(rectangles, key=lambda rect: rect.area, reverse=True)
+
+
+def small_frame(rng, boxes):
+    return random_frame(rng, boxes, 120, 80, min_size=(4, 8), max_size=(40, 60), jitter=3, boxes_per_person=4)
+
+
+def test_numpy_engine_does_not_import_nnmavmath(monkeypatch):
+    # Also when another test has loaded it already
+    monkeypatch.delitem(sys.modules, 'nnmavmath', raising=False)
+    monkeypatch.setattr(non_overlapping_detections, 'geometry', None)
+    non_overlapping_detections_numpy([[0, 0, 10, 10, 0.9], [5, 5, 10, 10, 0.8]])
+    assert 'nnmavmath' not in sys.modules
+
+
+@pytest.mark.parametrize("boxes", [1, 2, 5, 20, 50])
+def test_numpy_engine_partitions_the_detections(boxes):
+    rng = np.random.default_rng(boxes)
+    for _ in range(50):
+        detections = small_frame(rng, boxes)
+        union = coverage([detection[:4] for detection in detections]) > 0
+        for output in (non_overlapping_detections_numpy(detections),
+                       merge_boxes(non_overlapping_detections_numpy(detections))):
+            counts = coverage(output)
+            assert counts.max() <= 1
+            assert np.array_equal(counts > 0, union)
+
+
+def test_numpy_engine_keeps_float_coordinates():
+    detections = [[0.5, 0.5, 2.0, 1.0], [1.5, 0.0, 2.0, 2.25]]
+    output = non_overlapping_detections_numpy(detections)
+    # Union area: 2 + 4.5 - overlap 1 * 1
+    assert sum(width * height for _, _, width, height in output) == pytest.approx(5.5)
+    assert all(isinstance(value, float) for box in output for value in box)
+
+
+def test_numpy_engine_without_detections():
+    assert non_overlapping_detections_numpy([]) == []
+    assert merge_boxes([]) == []
+
+
+@pytest.mark.parametrize("boxes", [1, 2, 5, 20, 50])
+def test_grouping_equals_connected_components(boxes):
+    rng = np.random.default_rng(100 + boxes)
+    for _ in range(100):
+        rectangles = rectangles_of(small_frame(rng, boxes))
+        before = list(rectangles)
+        groups = group_overlapping_detections(rectangles)
+        assert rectangles == before
+        components = partition(groups, rectangles)
+        assert components == connected_components(rectangles)
+        # Groups keep the order of their first rectangle, members the input order
+        firsts = [rectangles.index(group[0]) for group in groups]
+        assert firsts == sorted(firsts)
+        assert all([rectangles.index(rect) for rect in group] == sorted(rectangles.index(rect) for rect in group)
+                   for group in groups)
+
+        # The previous grouping may only split components, never join them
+        pairwise = partition(group_overlapping_detections_pairwise(list(rectangles)), rectangles)
+        assert all(any(group <= component for component in components) for group in pairwise)
+
+
+def test_grouping_joins_chains_the_pairwise_scan_splits():
+    # a overlaps b, b overlaps c, a and c are apart: the pairwise scan adds b to a's group and then starts a group
+    # with c, as b is only checked on the next pass
+    a, b, c = Rect(0, 0, 10, 10), Rect(8, 0, 6, 6), Rect(12, 0, 4, 4)
+    assert partition(group_overlapping_detections_pairwise([a, b, c]), [a, b, c]) == {frozenset({0, 1}),
+                                                                                        frozenset({2})}
+    assert partition(group_overlapping_detections([a, b, c]), [a, b, c]) == {frozenset({0, 1, 2})}
+
+
+def test_grouping_without_rectangles():
+    assert group_overlapping_detections([]) == []
+
+
+def clean_up_oracle(rectangles):
+    # A rectangle goes when an earlier one, by decreasing area, contains it: x0, y0 <= and x1, y1 >= its own
+    rectangles = sorted(rectangles, key=lambda rect: rect.area, reverse=True)
+
+    def contains(outer, inner):
+        return (outer.bounds[0] <= inner.bounds[0] and outer.bounds[1] <= inner.bounds[1]
+                and inner.bounds[2] <= outer.bounds[2] and inner.bounds[3] <= outer.bounds[3])
+    return [rect for j, rect in enumerate(rectangles) if not any(contains(other, rect) for other in rectangles[:j])]
+
+
+@pytest.mark.parametrize("rectangles, kept", [
+    # Equal boxes: the first one stays
+    ([Rect(0, 0, 4, 4), Rect(0, 0, 4, 4), Rect(0, 0, 4, 4)], [0]),
+    # Containment sharing one, two and three edges
+    ([Rect(0, 0, 10, 10), Rect(0, 2, 3, 3), Rect(0, 0, 3, 3), Rect(0, 0, 10, 3)], [0]),
+    # Strict containment
+    ([Rect(2, 2, 2, 2), Rect(0, 0, 10, 10)], [1]),
+    # Overlapping and touching boxes stay
+    ([Rect(0, 0, 4, 4), Rect(2, 2, 4, 4), Rect(4, 0, 4, 4)], [0, 1, 2]),
+    # Zero-area boxes: among equal areas only an earlier box removes a later one
+    ([Rect(0, 0, 0, 5), Rect(0, 1, 0, 2)], [0]),
+    ([Rect(0, 1, 0, 2), Rect(0, 0, 0, 5)], [0, 1]),
+])
+def test_clean_up_cases(rectangles, kept):
+    expected = [rectangles[i] for i in kept]
+    assert clean_up_rectangles(list(rectangles)) == clean_up_oracle(rectangles)
+    assert clean_up_rectangles(list(rectangles)) == clean_up_rectangles_pairwise(list(rectangles))
+    assert set(map(id, clean_up_rectangles(list(rectangles)))) == set(map(id, expected))
+
+
+def test_clean_up_random_fragments():
+    rng = np.random.default_rng(7)
+    for _ in range(200):
+        # Few distinct coordinates, so that duplicates and shared edges are common
+        corners = rng.integers(0, 6, (rng.integers(1, 40), 2))
+        sizes = rng.integers(0, 4, corners.shape)
+        rectangles = [Rect(x, y, width, height) for (x, y), (width, height) in zip(corners.tolist(), sizes.tolist())]
+        remaining = clean_up_rectangles(list(rectangles))
+        assert remaining == clean_up_oracle(rectangles)
+        assert remaining == clean_up_rectangles_pairwise(list(rectangles))
+
+
+def test_clean_up_matches_nnmavmath_containment():
+    # The bounds comparison assumes that encloses_quad is non-strict; check it against the real Quadrilateral
+    pytest.importorskip("nnmavmath")
+    geometry = load_geometry()
+    big, edge, inside = (geometry.Quadrilateral.rectangle(0, 0, 10, 10), geometry.Quadrilateral.rectangle(0, 0, 10, 3),
+                         geometry.Quadrilateral.rectangle(2, 2, 3, 3))
+    assert rectangle_bounds(big) == (0, 0, 10, 10)
+    assert big.encloses_quad(edge) and big.encloses_quad(inside) and not edge.encloses_quad(big)
+
+    rng = np.random.default_rng(11)
+    for _ in range(100):
+        corners = rng.integers(0, 6, (rng.integers(1, 30), 2))
+        sizes = rng.integers(1, 4, corners.shape)
+        rectangles = [geometry.Quadrilateral.rectangle(x, y, width, height)
+                      for (x, y), (width, height) in zip(corners.tolist(), sizes.tolist())]
+        assert clean_up_rectangles(list(rectangles)) == clean_up_rectangles_pairwise(list(rectangles))